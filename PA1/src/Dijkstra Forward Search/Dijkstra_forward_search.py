@@ -3,7 +3,7 @@ from math import inf, sqrt
 from heapq import heappop, heappush
 
 
-def dijkstras_shortest_path(initial_position, destination, graph, adj):
+def dijkstras_shortest_path(initial_position, destination, graph, adj, stats=None):
     """ Searches for a minimal cost path through a graph using Dijkstra's algorithm.
 
     Args:
@@ -11,6 +11,7 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
         destination: The end location for the path.
         graph: A loaded level, containing walls, spaces, and waypoints.
         adj: An adjacency function returning cells adjacent to a given cell as well as their respective edge costs.
+        stats: An optional dict; its 'expanded' entry is set to the number of cells expanded.
 
     Returns:
         If a path exits, return a list containing all cells from initial_position to destination.
@@ -21,10 +22,14 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
     pathcosts = {initial_position: 0}       # maps cells to their pathcosts (found so far)
     queue = []
     heappush(queue, (0, initial_position))  # maintain a priority queue of cells
+    expanded = 0
     
     while queue:
         priority, cell = heappop(queue)
+        expanded += 1
         if cell == destination:
+            if stats is not None:
+                stats['expanded'] = expanded
             return path_to_cell(cell, paths)
         
         # investigate children
@@ -36,15 +41,144 @@ def dijkstras_shortest_path(initial_position, destination, graph, adj):
                 paths[child] = cell                         # set the backpointer
                 heappush(queue, (cost_to_child, child))     # put the child on the priority queue
             
+    if stats is not None:
+        stats['expanded'] = expanded
     return False
 
 def path_to_cell(cell, paths):
     if cell == []:
         return []
     return path_to_cell(paths[cell], paths) + [cell]
-    
 
 
+def walk_back(cell, previous):
+    """ Follows back-pointers (None at the start) from cell; returns the cells from the start to cell. """
+    path = []
+    while cell is not None:
+        path.append(cell)
+        cell = previous[cell]
+    path.reverse()
+    return path
+
+
+def min_cell_cost(level):
+    """ The smallest cost of any space, cached in level['min_cost'] until the spaces are replaced or resized. """
+    spaces = level['spaces']
+    cached = level.get('min_cost')
+    if cached is None or cached[0] is not spaces or cached[1] != len(spaces):
+        cached = (spaces, len(spaces), min(spaces.values(), default=0))
+        level['min_cost'] = cached
+    return cached[2]
+
+
+def octile_distance(cell, cell2):
+    """ The length of the shortest 8-connected route between two cells on an empty grid. """
+    dx, dy = abs(cell[0] - cell2[0]), abs(cell[1] - cell2[1])
+    return max(dx, dy) + (sqrt(2) - 1) * min(dx, dy)
+
+
+def astar_shortest_path(initial_position, destination, graph, adj, stats=None):
+    """ Searches for a minimal cost path through a graph using A* with an octile-distance heuristic.
+
+    Every move of length d between cells costing c1 and c2 costs d * (c1 + c2) / 2, at least d times the
+    cheapest cell of the level, so the octile distance scaled by that cost never overestimates and the first
+    path found to the destination is a minimal one. The arguments and result are dijkstras_shortest_path's.
+
+    """
+    scale = min_cell_cost(graph)
+    previous = {initial_position: None}
+    pathcosts = {initial_position: 0}
+    closed = set()
+    queue = [(scale * octile_distance(initial_position, destination), 0, initial_position)]
+    expanded = 0
+
+    while queue:
+        _, cost, cell = heappop(queue)
+        if cell in closed:
+            continue
+        closed.add(cell)
+        expanded += 1
+        if cell == destination:
+            break
+
+        for (child, step_cost) in adj(graph, cell):
+            cost_to_child = cost + step_cost
+            if child not in closed and cost_to_child < pathcosts.get(child, inf):
+                pathcosts[child] = cost_to_child
+                previous[child] = cell
+                heappush(queue, (cost_to_child + scale * octile_distance(child, destination), cost_to_child, child))
+
+    if stats is not None:
+        stats['expanded'] = expanded
+    if destination not in closed:
+        return False
+    return walk_back(destination, previous)
+
+
+def bidirectional_shortest_path(initial_position, destination, graph, adj, stats=None):
+    """ Searches for a minimal cost path through a graph with two Dijkstra searches growing towards each other.
+
+    The backward search uses adj as well, so edges must cost the same both ways, as navigation_edges' do.
+    Each time an edge joins a cell reached from one side to a cell reached from the other, the cost of the
+    route through it is a candidate. The searches stop once the smallest costs on the two queues add up to no
+    less than the best candidate: any route not yet seen would have to cost at least that much. The arguments
+    and result are dijkstras_shortest_path's.
+
+    """
+    sides = [{'start': initial_position, 'costs': {initial_position: 0}, 'previous': {initial_position: None},
+              'closed': set(), 'queue': [(0, initial_position)]},
+             {'start': destination, 'costs': {destination: 0}, 'previous': {destination: None},
+              'closed': set(), 'queue': [(0, destination)]}]
+    best, meeting = (0, (initial_position, initial_position)) if initial_position == destination else (inf, None)
+    expanded = 0
+
+    while True:
+        for side in sides:
+            queue = side['queue']
+            while queue and queue[0][1] in side['closed']:
+                heappop(queue)
+        if not sides[0]['queue'] or not sides[1]['queue']:
+            break
+        if sides[0]['queue'][0][0] + sides[1]['queue'][0][0] >= best:
+            break
+
+        # expand the side whose next cell is closer to its start
+        side, other = sides if sides[0]['queue'][0][0] <= sides[1]['queue'][0][0] else sides[::-1]
+        cost, cell = heappop(side['queue'])
+        side['closed'].add(cell)
+        expanded += 1
+
+        for (child, step_cost) in adj(graph, cell):
+            cost_to_child = cost + step_cost
+            if child not in side['closed'] and cost_to_child < side['costs'].get(child, inf):
+                side['costs'][child] = cost_to_child
+                side['previous'][child] = cell
+                heappush(side['queue'], (cost_to_child, child))
+            if child in other['costs'] and cost_to_child + other['costs'][child] < best:
+                best = cost_to_child + other['costs'][child]
+                meeting = (cell, child) if side is sides[0] else (child, cell)
+
+    if stats is not None:
+        stats['expanded'] = expanded
+    if meeting is None:
+        return False
+
+    # the forward half up to the meeting edge, then the backward half from it
+    path = walk_back(meeting[0], sides[0]['previous'])
+    if meeting[1] != meeting[0]:
+        path.extend(reversed(walk_back(meeting[1], sides[1]['previous'])))
+    return path
+
+
+SEARCH_MODES = {'dijkstra': dijkstras_shortest_path,
+                'astar': astar_shortest_path,
+                'bidirectional': bidirectional_shortest_path}
+
+
+def shortest_path(initial_position, destination, graph, adj, mode='dijkstra', stats=None):
+    """ Searches for a minimal cost path with the search named by mode (a key of SEARCH_MODES). """
+    return SEARCH_MODES[mode](initial_position, destination, graph, adj, stats)
+
 
 def navigation_edges(level, cell):
     """ Provides a list of adjacent cells and their respective costs from the given cell.
@@ -76,13 +210,14 @@ def transition_cost(level, cell, cell2):
     return distance * average_cost
 
 
-def test_route(filename, src_waypoint, dst_waypoint):
+def test_route(filename, src_waypoint, dst_waypoint, mode='dijkstra'):
     """ Loads a level, searches for a path between the given waypoints, and displays the result.
 
     Args:
         filename: The name of the text file containing the level.
         src_waypoint: The character associated with the initial waypoint.
         dst_waypoint: The character associated with the destination waypoint.
+        mode: The search to use, a key of SEARCH_MODES.
 
     """
 
@@ -95,11 +230,13 @@ def test_route(filename, src_waypoint, dst_waypoint):
     dst = level['waypoints'][dst_waypoint]
 
     # Search for and display the path from src to dst.
-    path = dijkstras_shortest_path(src, dst, level, navigation_edges)
+    stats = {}
+    path = shortest_path(src, dst, level, navigation_edges, mode, stats)
     if path:
         show_level(level, path)
     else:
         print("No path possible!")
+    print("%s expanded %d cells." % (mode, stats['expanded']))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,327 @@
+# Array-backed search engine for maze levels.
+#
+# A level's cells are laid out on a NumPy cost grid, padded with a ring of
+# walls so no neighbor lookup can leave it, and named by flat integer
+# indices. The grid is stored x-major, so flat indices sort exactly like the
+# (x, y) cell tuples the dict-based search puts on its heap, and ties break
+# the same way: the engine finds the very same paths as
+# dijkstras_shortest_path with navigation_edges.
+
+from heapq import heappop, heappush
+from itertools import chain
+from math import inf, sqrt
+import random
+import sys
+import time
+
+import numpy
+
+from maze_environment import CELL_EMPTY, load_level, load_level_grid, save_distance_map
+
+# the 8 moves, in the order navigation_edges tries them
+NEIGHBOR_DELTAS = [(x, y) for x in [-1, 0, 1] for y in [-1, 0, 1] if not (x == 0 and y == 0)]
+
+
+def cell_array(cells):
+    """ The (x, y) cells of a collection as an N x 2 integer array. """
+    return numpy.fromiter(chain.from_iterable(cells), dtype=numpy.int64, count=2 * len(cells)).reshape(-1, 2)
+
+
+def build_grid(level):
+    """ Lays a loaded level out as arrays.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints, or a GridLevel with its cost grid.
+
+    Returns:
+        A dict with the 'costs' array (inf outside the spaces), indexed [x, y] from 'origin', the same costs
+        flattened into a list ('cost_list', which the search loop reads fastest), and the 'neighbors' table of
+        (flat index offset, step length) pairs for the 8 moves.
+
+    """
+    if 'cost_grid' in level:
+        # a GridLevel: trim its cost grid to the bounds of the walls and spaces, as load_level's dicts have them
+        codes = level['cost_grid']
+        used = codes != CELL_EMPTY
+        ys, xs = numpy.flatnonzero(used.any(axis=1)), numpy.flatnonzero(used.any(axis=0))
+        if not len(xs):
+            xs = ys = numpy.zeros(1, dtype=numpy.int64)
+        origin = (int(xs[0]) - 1, int(ys[0]) - 1)
+        shape = (int(xs[-1]) - origin[0] + 2, int(ys[-1]) - origin[1] + 2)
+        codes = codes[ys[0]:ys[-1] + 1, xs[0]:xs[-1] + 1].T
+        costs = numpy.full(shape, inf)
+        costs[1:-1, 1:-1] = numpy.where(codes <= 9, codes, inf)
+    else:
+        spaces = cell_array(level['spaces'])
+        cells = numpy.concatenate([spaces, cell_array(level['walls'])]) if level['walls'] else spaces
+        if not len(cells):
+            cells = numpy.zeros((1, 2), dtype=numpy.int64)
+        origin = (int(cells[:, 0].min()) - 1, int(cells[:, 1].min()) - 1)
+        shape = (int(cells[:, 0].max()) - origin[0] + 2, int(cells[:, 1].max()) - origin[1] + 2)
+        costs = numpy.full(shape, inf)
+        values = numpy.fromiter(level['spaces'].values(), dtype=float, count=len(spaces))
+        costs[spaces[:, 0] - origin[0], spaces[:, 1] - origin[1]] = values
+
+    height = shape[1]
+    neighbors = [(dx * height + dy, sqrt(dx ** 2 + dy ** 2)) for dx, dy in NEIGHBOR_DELTAS]
+
+    source, size = grid_source(level)
+    return {'source': source, 'size': size, 'origin': origin, 'shape': shape,
+            'costs': costs, 'cost_list': costs.ravel().tolist(), 'neighbors': neighbors}
+
+
+def grid_source(level):
+    """ What a level's grid is built from (its cost grid, or else its spaces dict) and that object's size. """
+    if 'cost_grid' in level:
+        return level['cost_grid'], level['cost_grid'].size
+    return level['spaces'], len(level['spaces'])
+
+
+def level_grid(level):
+    """ Returns the level's grid, cached in level['grid'] and rebuilt if its source has been replaced or resized. """
+    grid = level.get('grid')
+    source, size = grid_source(level)
+    if grid is None or grid['source'] is not source or grid['size'] != size:
+        grid = build_grid(level)
+        level['grid'] = grid
+    return grid
+
+
+def space_index(grid, cell):
+    """ The flat index of a cell, or None if the cell is not a space. """
+    x, y = cell[0] - grid['origin'][0], cell[1] - grid['origin'][1]
+    if not (0 <= x < grid['shape'][0] and 0 <= y < grid['shape'][1]):
+        return None
+    index = x * grid['shape'][1] + y
+    return index if grid['cost_list'][index] != inf else None
+
+
+def cell_index(grid, cell):
+    return (cell[0] - grid['origin'][0]) * grid['shape'][1] + (cell[1] - grid['origin'][1])
+
+
+def index_cell(grid, index):
+    x, y = divmod(index, grid['shape'][1])
+    return x + grid['origin'][0], y + grid['origin'][1]
+
+
+def walk_back_index(grid, prev, index):
+    """ Follows back-pointers from index to the start of the search; returns the cells in path order. """
+    path = []
+    while index >= 0:
+        path.append(index_cell(grid, index))
+        index = prev[index]
+    path.reverse()
+    return path
+
+
+def grid_dijkstra(grid, source, destination):
+    """ Dijkstra's algorithm over flat cell indices.
+
+    Args:
+        grid: A grid from level_grid.
+        source: The flat index of the initial cell.
+        destination: The flat index of the end cell, or None to settle every reachable cell.
+
+    Returns:
+        The (dist, prev) lists over all flat indices: the settled path costs (inf where unreached) and the
+        back-pointers (-1 at the source and where unreached).
+
+    """
+    cost = grid['cost_list']
+    neighbors = grid['neighbors']
+    dist = [inf] * len(cost)
+    prev = [-1] * len(cost)
+    closed = bytearray(len(cost))
+
+    dist[source] = 0
+    queue = [(0, source)]
+    while queue:
+        priority, cell = heappop(queue)
+        if closed[cell]:
+            continue
+        closed[cell] = 1
+        if cell == destination:
+            break
+
+        cell_cost = cost[cell]
+        for offset, distance in neighbors:
+            child = cell + offset
+            child_cost = cost[child]
+            if child_cost == inf or closed[child]:
+                continue
+            cost_to_child = priority + distance * ((cell_cost + child_cost) / 2)
+            if cost_to_child < dist[child]:
+                dist[child] = cost_to_child
+                prev[child] = cell
+                heappush(queue, (cost_to_child, child))
+
+    return dist, prev
+
+
+def grid_shortest_path(initial_position, destination, graph, adj=None):
+    """ Searches for a minimal cost path through a level with the array engine.
+
+    Args:
+        initial_position: The initial cell from which the path extends.
+        destination: The end location for the path.
+        graph: A loaded level, containing walls, spaces, and waypoints.
+        adj: Ignored; accepted so the engine can stand in for dijkstras_shortest_path. Edges are always the 8
+            moves of navigation_edges with its costs.
+
+    Returns:
+        If a path exists, a list containing all cells from initial_position to destination (exactly the path
+        dijkstras_shortest_path returns with navigation_edges). Otherwise, False.
+
+    """
+    grid = level_grid(graph)
+    source, target = space_index(grid, initial_position), space_index(grid, destination)
+    if source is None or target is None:
+        return False
+    dist, prev = grid_dijkstra(grid, source, target)
+    if dist[target] == inf:
+        return False
+    return walk_back_index(grid, prev, target)
+
+
+def distance_map(level, initial_position):
+    """ Computes the path cost from one cell to every cell of a level in a single search.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints.
+        initial_position: The cell the costs are measured from.
+
+    Returns:
+        A 2D array of path costs laid out like save_level_costs' CSV: rows are y and columns are x, over the
+        level's bounds, with inf for walls and unreachable cells.
+
+    """
+    grid = level_grid(level)
+    source = space_index(grid, initial_position)
+    if source is None:
+        return numpy.full((grid['shape'][1] - 2, grid['shape'][0] - 2), inf)
+    dist, _ = grid_dijkstra(grid, source, None)
+    return numpy.array(dist).reshape(grid['shape'])[1:-1, 1:-1].T
+
+
+def generate_maze(width, height, loops=0.1, seed=0):
+    """ Generates a random maze level (a depth-first carved maze with some extra openings) with costs 1 to 9.
+
+    Args:
+        width, height: The size of the level in cells, walls included; rounded up to odd numbers.
+        loops: The fraction of the remaining inner walls knocked out, so that routes have alternatives.
+        seed: The random seed.
+
+    Returns:
+        A level like load_level's, with waypoints 'a' and 'b' in opposite corners.
+
+    """
+    rng = random.Random(seed)
+    width, height = width | 1, height | 1
+    open_cells = set()
+    stack = [(1, 1)]
+    open_cells.add((1, 1))
+    while stack:
+        x, y = stack[-1]
+        options = [(dx, dy) for dx, dy in ((2, 0), (-2, 0), (0, 2), (0, -2))
+                   if 0 < x + dx < width - 1 and 0 < y + dy < height - 1 and (x + dx, y + dy) not in open_cells]
+        if not options:
+            stack.pop()
+            continue
+        dx, dy = rng.choice(options)
+        open_cells.add((x + dx // 2, y + dy // 2))
+        open_cells.add((x + dx, y + dy))
+        stack.append((x + dx, y + dy))
+
+    for x in range(1, width - 1):
+        for y in range(1, height - 1):
+            if (x, y) not in open_cells and (x + y) % 2 == 1 and rng.random() < loops:
+                open_cells.add((x, y))
+
+    spaces = {cell: float(rng.randint(1, 9)) for cell in sorted(open_cells)}
+    walls = {(x, y) for x in range(width) for y in range(height) if (x, y) not in spaces}
+    waypoints = {'a': (1, 1), 'b': (width - 2, height - 2)}
+    for cell in waypoints.values():
+        spaces[cell] = 1.
+    return {'walls': walls, 'spaces': spaces, 'waypoints': waypoints}
+
+
+if __name__ == '__main__':
+    # grid_engine.py map [size]: times a distance map and its CSV export on a generated maze
+    # grid_engine.py [size ...]: checks the engine against the dict search on example.txt, then times both
+    from Dijkstra_forward_search import dijkstras_shortest_path, navigation_edges
+
+    if sys.argv[1:2] == ['load']:
+        # grid_engine.py load [size]: load_level against load_level_grid on a generated maze written out as text
+        import os
+        import tempfile
+        import tracemalloc
+
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 2001
+        level = generate_maze(size, size)
+        chars = numpy.full((size | 1, size | 1), ord('X'), dtype=numpy.uint8)
+        spaces = cell_array(level['spaces'])
+        chars[spaces[:, 1], spaces[:, 0]] = ord('0') + numpy.fromiter(level['spaces'].values(), dtype=float).astype(int)
+        for name, (x, y) in level['waypoints'].items():
+            chars[y, x] = ord(name)
+        filename = os.path.join(tempfile.mkdtemp(), 'maze.txt')
+        with open(filename, 'wb') as f:
+            f.write(b'\n'.join(row.tobytes() for row in chars))
+
+        # load_level goes last: the millions of objects it leaves behind slow every later collection
+        for name, load in (('load_level_grid', load_level_grid),
+                           ('cache (cold)', lambda f: load_level_grid(f, cache=True)),
+                           ('cache (warm)', lambda f: load_level_grid(f, cache=True)),
+                           ('load_level', load_level)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            loaded = load(filename)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-16s %7.3fs  peak %7.1f MB" % (name, elapsed, peak / 2 ** 20))
+            assert loaded['waypoints'] == level['waypoints']
+        assert load_level_grid(filename, cache=True)['spaces'] == loaded['spaces'] == level['spaces']
+        sys.exit(0)
+
+    if sys.argv[1:2] == ['map']:
+        size = int(sys.argv[2]) if len(sys.argv) > 2 else 2001
+        level = generate_maze(size, size)
+        start = time.perf_counter()
+        distances = distance_map(level, level['waypoints']['a'])
+        searched = time.perf_counter() - start
+        start = time.perf_counter()
+        save_distance_map(distances)
+        saved = time.perf_counter() - start
+        print("%dx%d maze, %d reachable cells: distance map %.2fs, CSV export %.2fs"
+              % (size, size, numpy.isfinite(distances).sum(), searched, saved))
+        sys.exit(0)
+
+    level = load_level('example.txt')
+    for src in sorted(level['waypoints']):
+        for dst in sorted(level['waypoints']):
+            a, b = level['waypoints'][src], level['waypoints'][dst]
+            assert grid_shortest_path(a, b, level) == dijkstras_shortest_path(a, b, level, navigation_edges)
+    print("example.txt: same paths for all %d waypoint pairs" % len(level['waypoints']) ** 2)
+
+    sizes = [int(size) for size in sys.argv[1:]] or [101, 301, 1001]
+    for size in sizes:
+        level = generate_maze(size, size)
+        src, dst = level['waypoints']['a'], level['waypoints']['b']
+
+        # the dict search rebuilds its paths recursively, one frame per cell
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), len(level['spaces']) + 100))
+        start = time.perf_counter()
+        expected = dijkstras_shortest_path(src, dst, level, navigation_edges)
+        reference = time.perf_counter() - start
+
+        start = time.perf_counter()
+        level_grid(level)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        path = grid_shortest_path(src, dst, level)
+        searched = time.perf_counter() - start
+
+        assert path == expected
+        print("%dx%d maze, %d spaces, path of %d cells: dict search %.3fs, grid %.3fs + %.3fs to build (%.1fx)"
+              % (size, size, len(level['spaces']), len(path), reference, searched, built, reference / searched))
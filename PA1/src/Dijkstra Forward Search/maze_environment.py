@@ -1,10 +1,19 @@
 # Implements a maze environment containing cells with walls, spaces, and waypoints
 
+from collections.abc import MutableMapping
 from math import inf
 from csv import writer
+from hashlib import sha256
+import os
+
+import numpy
 
 WALL = 'X'
 
+# codes in a level's uint8 cost grid besides the space costs 0-9
+CELL_WALL = 255
+CELL_EMPTY = 254
+
 
 def load_level(filename):
     """ Loads a level from a given text file.
@@ -41,6 +50,134 @@ def load_level(filename):
     return level
 
 
+def level_hash(filename):
+    """ The SHA-256 hex digest of a level file's contents. """
+    with open(filename, 'rb') as f:
+        return sha256(f.read()).hexdigest()
+
+
+def parse_level(text):
+    """ Parses the bytes of a level file in one vectorized pass.
+
+    Args:
+        text: The contents of the level file.
+
+    Returns:
+        The level's uint8 cost grid, indexed [y, x]: the cost of each space (waypoints cost 1), CELL_WALL for
+        walls and CELL_EMPTY for anything else, and its waypoints as a dict of characters to (x, y) cells.
+
+    """
+    if not text.endswith(b'\n'):
+        text += b'\n'
+    chars = numpy.frombuffer(text, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(chars == ord('\n'))
+    starts = numpy.concatenate([[0], ends[:-1] + 1])
+    lengths = ends - starts
+
+    if len(ends) and (lengths == lengths[0]).all():
+        # equal lines: the text is already the grid, with a column of newlines to drop
+        grid = chars.reshape(len(ends), lengths[0] + 1)[:, :-1]
+    else:
+        # scatter each character to its (line, column), leaving out the newlines
+        rows = numpy.repeat(numpy.arange(len(ends)), lengths + 1)
+        columns = numpy.arange(len(chars)) - starts[rows]
+        keep = chars != ord('\n')
+        grid = numpy.full((len(ends), int(lengths.max(initial=0))), ord(' '), dtype=numpy.uint8)
+        grid[rows[keep], columns[keep]] = chars[keep]
+
+    digits = (grid >= ord('0')) & (grid <= ord('9'))
+    lowers = (grid >= ord('a')) & (grid <= ord('z'))
+    costs = numpy.full(grid.shape, CELL_EMPTY, dtype=numpy.uint8)
+    costs[digits] = grid[digits] - ord('0')
+    costs[lowers] = 1
+    costs[grid == ord(WALL)] = CELL_WALL
+
+    # a later occurrence of a waypoint character wins, as in load_level
+    ys, xs = numpy.nonzero(lowers)
+    waypoints = {chr(c): (x, y) for c, x, y in zip(grid[ys, xs].tolist(), xs.tolist(), ys.tolist())}
+    return costs, waypoints
+
+
+class GridLevel(MutableMapping):
+    """ A level backed by its uint8 'cost_grid', as load_level_grid returns it.
+
+    'waypoints' is filled in up front; the 'walls' set and the 'spaces' dict of load_level are only built (and
+    then kept) the first time they are looked up, so callers that still need them keep working. Membership
+    tests, get() and keys() see them before that, as they would in load_level's dict.
+
+    """
+
+    lazy_keys = ('spaces', 'walls')
+
+    def __init__(self, *args, **kwargs):
+        self.data = dict(*args, **kwargs)
+
+    def __getitem__(self, key):
+        if key in self.data:
+            return self.data[key]
+        costs = self.data['cost_grid']
+        if key == 'spaces':
+            ys, xs = numpy.nonzero(costs <= 9)
+            value = dict(zip(zip(xs.tolist(), ys.tolist()), costs[ys, xs].astype(float).tolist()))
+        elif key == 'walls':
+            ys, xs = numpy.nonzero(costs == CELL_WALL)
+            value = set(zip(xs.tolist(), ys.tolist()))
+        else:
+            raise KeyError(key)
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        del self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data or key in self.lazy_keys
+
+    def __iter__(self):
+        yield from self.data
+        yield from (key for key in self.lazy_keys if key not in self.data)
+
+    def __len__(self):
+        return len(self.data) + sum(key not in self.data for key in self.lazy_keys)
+
+
+def load_level_grid(filename, cache=False):
+    """ Loads a level from a given text file into a dense cost grid.
+
+    Args:
+        filename: The name of the txt file containing the maze.
+        cache: Whether to keep a compiled copy of the level next to the file (<filename>.grid.npz), checked
+            against a hash of the text and rebuilt when the text changes.
+
+    Returns:
+        The loaded level (GridLevel) with its 'cost_grid' and 'waypoints'.
+
+    """
+    with open(filename, 'rb') as f:
+        text = f.read()
+    digest = sha256(text).hexdigest()
+    cache_filename = filename + '.grid.npz'
+
+    if cache and os.path.exists(cache_filename):
+        with numpy.load(cache_filename) as data:
+            if str(data['hash']) == digest:
+                return GridLevel(cost_grid=data['cost_grid'],
+                                 waypoints={str(c): tuple(cell) for c, cell in zip(data['names'].tolist(),
+                                                                                   data['cells'].tolist())})
+
+    costs, waypoints = parse_level(text)
+    if cache:
+        names = sorted(waypoints)
+        with open(cache_filename + '.tmp', 'wb') as f:
+            numpy.savez(f, cost_grid=costs, hash=numpy.array(digest), names=numpy.array(names, dtype='U1'),
+                        cells=numpy.array([waypoints[c] for c in names], dtype=numpy.int64).reshape(-1, 2))
+        os.replace(cache_filename + '.tmp', cache_filename)
+    return GridLevel(cost_grid=costs, waypoints=waypoints)
+
+
 def show_level(level, path=[]):
     """ Displays a level via a print statement.
 
@@ -110,4 +247,19 @@ def save_level_costs(level, costs, filename='distance_map.csv'):
         for row in rows:
             csv_writer.writerow(row)
 
-    print("Saved file:", filename)
\ No newline at end of file
+    print("Saved file:", filename)
+
+
+def save_distance_map(distances, filename='distance_map.csv', fmt='%.10g'):
+    """ Saves a 2D array of cell costs, such as a distance map, as a csv file in one vectorized write.
+
+    Args:
+        distances: A 2D array of costs, rows being y and columns x (inf for unreachable cells).
+        filename: The name of the csv file to be created.
+        fmt: The printf-style format of each cost.
+
+    """
+    assert '.csv' in filename, 'Error: filename does not contain file type.'
+    numpy.savetxt(filename, distances, fmt=fmt, delimiter=',')
+
+    print("Saved file:", filename)
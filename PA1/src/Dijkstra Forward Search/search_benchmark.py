@@ -0,0 +1,41 @@
+# Compares the search modes of Dijkstra_forward_search on a level's waypoints.
+#
+# Every mode searches between every pair of waypoints; the cells each one
+# expands are totalled, and the costs of the paths they return are checked
+# to be the same as plain Dijkstra's.
+
+from math import inf
+import sys
+
+from maze_environment import load_level
+from Dijkstra_forward_search import SEARCH_MODES, navigation_edges, shortest_path, transition_cost
+
+
+def compare_modes(level, pairs):
+    """ Runs every search mode on each (src, dst) pair of cells, printing the cells each expands.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints.
+        pairs: The (initial_position, destination) pairs to search between.
+
+    """
+    totals = dict.fromkeys(SEARCH_MODES, 0)
+    for src, dst in pairs:
+        costs = {}
+        for mode in SEARCH_MODES:
+            stats = {}
+            path = shortest_path(src, dst, level, navigation_edges, mode, stats)
+            totals[mode] += stats['expanded']
+            costs[mode] = sum(transition_cost(level, a, b) for a, b in zip(path, path[1:])) if path else inf
+        assert all(cost == costs['dijkstra'] or abs(cost - costs['dijkstra']) < 1e-9 for cost in costs.values()), costs
+    for mode, total in totals.items():
+        print("%-14s %10d cells expanded (%.1f per search)" % (mode, total, total / max(len(pairs), 1)))
+
+
+
+
+if __name__ == '__main__':
+    # search_benchmark.py [level.txt]
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'example.txt'
+    level = load_level(filename)
+    compare_modes(level, [(a, b) for a in level['waypoints'].values() for b in level['waypoints'].values()])
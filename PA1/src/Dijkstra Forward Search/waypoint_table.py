@@ -0,0 +1,94 @@
+# Precomputed routes between every pair of waypoints of a level.
+#
+# One full single-source search per waypoint settles the costs and
+# back-pointers to every cell, so the routes from that waypoint to all the
+# others are read off it without searching again. The table is pickled next
+# to the level file together with a hash of the file's contents; later runs
+# answer waypoint-to-waypoint queries from it, and a table whose hash no
+# longer matches (the level was edited) is rebuilt.
+
+from math import inf
+import os
+import pickle
+import sys
+
+from maze_environment import level_hash, load_level, load_level_grid, show_level
+from grid_engine import cell_index, grid_dijkstra, level_grid, walk_back_index
+
+
+def table_filename(filename):
+    return filename + '.waypoints.pickle'
+
+
+def build_waypoint_table(level):
+    """ Finds the minimal cost route between every ordered pair of waypoints.
+
+    Args:
+        level: A loaded level, containing walls, spaces, and waypoints.
+
+    Returns:
+        A dict with 'distances' mapping (src_waypoint, dst_waypoint) to the path cost (inf if there is no path)
+        and 'paths' mapping the same pairs to the list of cells from src to dst (False if there is none), the
+        same paths dijkstras_shortest_path finds.
+
+    """
+    grid = level_grid(level)
+    waypoints = level['waypoints']
+    distances, paths = {}, {}
+    for src in sorted(waypoints):
+        dist, prev = grid_dijkstra(grid, cell_index(grid, waypoints[src]), None)
+        for dst in sorted(waypoints):
+            target = cell_index(grid, waypoints[dst])
+            distances[src, dst] = dist[target]
+            paths[src, dst] = walk_back_index(grid, prev, target) if dist[target] != inf else False
+    return {'distances': distances, 'paths': paths}
+
+
+def load_waypoint_table(filename):
+    """ Returns the waypoint table of a level file, from its cache if still valid, otherwise built and cached.
+
+    Args:
+        filename: The name of the text file containing the level.
+
+    Returns:
+        The table (see build_waypoint_table) with the level's 'hash' added.
+
+    """
+    digest = level_hash(filename)
+    cache = table_filename(filename)
+    if os.path.exists(cache):
+        with open(cache, 'rb') as f:
+            table = pickle.load(f)
+        if table.get('hash') == digest:
+            return table
+
+    table = build_waypoint_table(load_level_grid(filename))
+    table['hash'] = digest
+    with open(cache + '.tmp', 'wb') as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache + '.tmp', cache)
+    return table
+
+
+def waypoint_route(table, src_waypoint, dst_waypoint):
+    """ The cached (path, cost) from one waypoint to another; the path is False if there is none. """
+    return table['paths'][src_waypoint, dst_waypoint], table['distances'][src_waypoint, dst_waypoint]
+
+
+if __name__ == '__main__':
+    # waypoint_table.py [level.txt [src dst]]: prints the distance table, or shows one cached route
+    filename = sys.argv[1] if len(sys.argv) > 1 else 'example.txt'
+    table = load_waypoint_table(filename)
+
+    if len(sys.argv) > 3:
+        path, cost = waypoint_route(table, sys.argv[2], sys.argv[3])
+        if path:
+            show_level(load_level(filename), path)
+            print("Cost:", cost)
+        else:
+            print("No path possible!")
+    else:
+        names = sorted({src for src, _ in table['distances']})
+        print('   ' + ''.join('%9s' % dst for dst in names))
+        for src in names:
+            print('%-3s' % src + ''.join('%9.2f' % table['distances'][src, dst] for dst in names))
@@ -0,0 +1,300 @@
+import contextlib
+import glob
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import numpy
+
+import nm_hierarchy
+import nm_landmarks
+import nm_meshbuilder
+import nm_meshformat
+import nm_pathfinder
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'input')
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nm_benchmark_baseline.json')
+
+# find_path options for each search variant the suite measures
+VARIANTS = {
+    'euclidean': {'landmarks': False},
+    'landmarks': {'landmarks': True},
+    'hierarchical': {'landmarks': False, 'hierarchical': True},
+    'smooth': {'smooth': True},
+}
+
+
+def mesh_files(pattern='*.mesh.pickle'):
+    return sorted(glob.glob(os.path.join(INPUT_DIR, pattern)))
+
+
+def image_files(pattern='*.png'):
+    """Source map images, leaving out the *.mesh.png atlases nm_meshbuilder writes next to them."""
+    return sorted(f for f in glob.glob(os.path.join(INPUT_DIR, pattern)) if not f.endswith('.mesh.png'))
+
+
+def load_image(filename, scale=1):
+    """Reads a map image the way nm_meshbuilder does, optionally upscaled by an integer factor."""
+    image = (nm_meshbuilder.imread(filename) * 255).astype(numpy.uint8)
+    if len(image.shape) > 2:
+        image = image[:, :, 0]
+    if scale > 1:
+        image = numpy.kron(image, numpy.ones((scale, scale), dtype=numpy.uint8))
+    return image
+
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... up to max_workers, always ending with max_workers."""
+    workers = [1]
+    while workers[-1] * 2 <= max_workers:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != max_workers:
+        workers.append(max_workers)
+    return workers
+
+
+def random_pairs(mesh, n, seed=0):
+    """Seeded random (source_point, destination_point) pairs whose boxes are connected."""
+    rng = random.Random(seed)
+    boxes = list(mesh['boxes'])
+    labels = nm_meshformat.component_lookup(mesh)
+
+    def random_point(box):
+        return rng.uniform(box[0], box[1]), rng.uniform(box[2], box[3])
+
+    pairs = []
+    while len(pairs) < n:
+        a, b = rng.choice(boxes), rng.choice(boxes)
+        if labels[a] == labels[b]:
+            pairs.append((random_point(a), random_point(b)))
+    return pairs
+
+
+def benchmark_batch(mesh, pairs, workers):
+    """Seconds taken by find_paths for each worker count (pool start-up included)."""
+    timings = {}
+    for n in workers:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            nm_pathfinder.find_paths(pairs, mesh, workers=n)
+        timings[n] = time.perf_counter() - start
+    return timings
+
+
+def benchmark_build(image, min_feature_size, workers, tile_size=nm_meshbuilder.DEFAULT_TILE_SIZE):
+    """Seconds taken by the serial build_mesh (key 'serial') and by build_mesh_tiled for each worker count."""
+    start = time.perf_counter()
+    nm_meshbuilder.build_mesh(image, min_feature_size)
+    timings = {'serial': time.perf_counter() - start}
+    for n in workers:
+        start = time.perf_counter()
+        nm_meshbuilder.build_mesh_tiled(image, min_feature_size, tile_size, workers=n)
+        timings[n] = time.perf_counter() - start
+    return timings
+
+
+def mean_expanded(mesh, pairs, **options):
+    """Mean number of boxes expanded per query, passing options through to find_path."""
+    total = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for source_point, destination_point in pairs:
+            _, visited = nm_pathfinder.find_path(source_point, destination_point, mesh, **options)
+            total += len(visited)
+    return total / max(len(pairs), 1)
+
+
+def benchmark_landmarks(mesh, pairs, k=nm_landmarks.DEFAULT_LANDMARKS):
+    """Mean expansions without and with landmark tables (built here unless the mesh already has them)."""
+    if 'landmarks' not in mesh:
+        mesh['landmarks'] = nm_landmarks.build_landmarks(mesh, k)
+    return mean_expanded(mesh, pairs, landmarks=False), mean_expanded(mesh, pairs, landmarks=True)
+
+
+def path_length(path):
+    return sum(math.dist(a, b) for a, b in zip(path, path[1:]))
+
+
+def prepare_mesh(mesh):
+    """Builds whatever tables the variants need (unless loaded as sidecars) and the lazily cached indexes."""
+    if 'landmarks' not in mesh:
+        mesh['landmarks'] = nm_landmarks.build_landmarks(mesh)
+    if 'hierarchy' not in mesh:
+        mesh['hierarchy'] = nm_hierarchy.build_hierarchy(mesh)
+    nm_pathfinder.box_index(mesh)
+    nm_meshformat.mesh_portals(mesh)
+
+
+def benchmark_variant(mesh, pairs, repeats=3, **options):
+    """
+    Times find_path on every pair one query at a time and summarizes the run.
+
+    Each query's latency is the best of repeats runs, which keeps scheduler
+    noise out of the percentiles.
+    """
+    latencies, expanded, lengths = [], [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        # one untimed query builds per-mesh lookup tables (landmark rows, hierarchy graph)
+        nm_pathfinder.find_path(pairs[0][0], pairs[0][1], mesh, **options)
+        for source_point, destination_point in pairs:
+            best = math.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                path, visited = nm_pathfinder.find_path(source_point, destination_point, mesh, **options)
+                best = min(best, time.perf_counter() - start)
+            latencies.append(best)
+            expanded.append(len(visited))
+            if path:
+                lengths.append(path_length(path))
+
+    latencies = numpy.asarray(latencies)
+    return {'queries_per_second': len(pairs) / latencies.sum(),
+            'p50_ms': float(numpy.percentile(latencies, 50)) * 1000,
+            'p99_ms': float(numpy.percentile(latencies, 99)) * 1000,
+            'mean_expanded': float(numpy.mean(expanded)),
+            'mean_path_length': float(numpy.mean(lengths)) if lengths else None,
+            'found': len(lengths)}
+
+
+def benchmark_merge(image, min_feature_size=16, queries=200, seed=0, repeats=3):
+    """Box and edge counts and find_path performance (euclidean heuristic) before and after merge_boxes."""
+    results = {}
+    mesh = nm_meshbuilder.build_mesh(image, min_feature_size)
+    pairs = random_pairs(mesh, queries, seed)
+    for name, m in (('built', mesh), ('merged', nm_meshbuilder.merge_boxes(mesh))):
+        nm_pathfinder.box_index(m)
+        result = benchmark_variant(m, pairs, repeats, landmarks=False)
+        result['boxes'] = len(m['boxes'])
+        result['edges'] = sum(len(neighbors) for neighbors in m['adj'].values()) // 2
+        results[name] = result
+    return results
+
+
+def run_suite(queries=200, seed=0, variants=VARIANTS, repeats=3):
+    """Benchmarks every variant on every shipped mesh with seeded reachable pairs; returns a JSON-ready dict."""
+    results = {'queries': queries, 'seed': seed, 'repeats': repeats, 'meshes': {}}
+    for filename in mesh_files():
+        mesh = nm_meshformat.load_mesh(filename)
+        prepare_mesh(mesh)
+        pairs = random_pairs(mesh, queries, seed)
+        results['meshes'][os.path.basename(filename)] = {
+            name: benchmark_variant(mesh, pairs, repeats, **options) for name, options in variants.items()}
+    return results
+
+
+def compare_results(results, baseline, time_tolerance=0.25, tail_tolerance=0.5, count_tolerance=0.01):
+    """
+    Compares results against a baseline run; returns (regressions, slowdowns).
+
+    Only the regressions should fail a run. They cover the deterministic
+    figures of a given query set: paths found may not drop, and expansions
+    and path lengths may only grow by count_tolerance (relative). Timings
+    depend on the machine and its load, so slower timings are only reported
+    as slowdowns: throughput or p50 latency beyond time_tolerance, and p99
+    latency, which rests on a handful of queries, beyond tail_tolerance.
+    """
+    if (results['queries'], results['seed']) != (baseline['queries'], baseline['seed']):
+        return ["query sets differ: %d queries seed %d vs baseline %d queries seed %d"
+                % (results['queries'], results['seed'], baseline['queries'], baseline['seed'])], []
+
+    checks = [('mean_expanded', 1, count_tolerance), ('mean_path_length', 1, count_tolerance)]
+    timing_checks = [('queries_per_second', -1, time_tolerance), ('p50_ms', 1, time_tolerance),
+                     ('p99_ms', 1, tail_tolerance)]
+    regressions, slowdowns = [], []
+    for mesh_name, variants in baseline['meshes'].items():
+        for variant, old in variants.items():
+            new = results['meshes'].get(mesh_name, {}).get(variant)
+            if new is None:
+                continue
+            if new['found'] < old['found']:
+                regressions.append("%s %s: found %d paths, baseline %d" % (mesh_name, variant, new['found'], old['found']))
+            for report, check_list in ((regressions, checks), (slowdowns, timing_checks)):
+                for key, sign, tolerance in check_list:
+                    if new[key] is None or old[key] is None:
+                        continue
+                    if sign * (new[key] - old[key]) > tolerance * old[key]:
+                        report.append("%s %s: %s %.4g, baseline %.4g" % (mesh_name, variant, key, new[key], old[key]))
+    return regressions, slowdowns
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'suite':
+        # nm_benchmark.py suite [queries] [out.json] [baseline.json]
+        queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        out_filename = sys.argv[3] if len(sys.argv) > 3 else None
+        baseline_filename = sys.argv[4] if len(sys.argv) > 4 else BASELINE
+
+        results = run_suite(queries)
+        for mesh_name, variants in results['meshes'].items():
+            print(mesh_name)
+            for variant, r in variants.items():
+                print("  %-13s %9.1f queries/s  p50 %7.3fms  p99 %7.3fms  %7.1f expanded  length %.1f"
+                      % (variant, r['queries_per_second'], r['p50_ms'], r['p99_ms'], r['mean_expanded'],
+                         r['mean_path_length'] or 0))
+        if out_filename:
+            with open(out_filename, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if os.path.exists(baseline_filename):
+            with open(baseline_filename) as f:
+                regressions, slowdowns = compare_results(results, json.load(f))
+            for line in slowdowns:
+                print("slower (timing, not gated) " + line)
+            for line in regressions:
+                print("REGRESSION " + line)
+            print("%d regressions, %d slower timings against %s"
+                  % (len(regressions), len(slowdowns), baseline_filename))
+            sys.exit(1 if regressions else 0)
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'merge':
+        # nm_benchmark.py merge [queries]
+        queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        for filename in image_files():
+            results = benchmark_merge(load_image(filename), queries=queries)
+            print(os.path.basename(filename))
+            for name, r in results.items():
+                print("  %-7s %6d boxes %6d edges %9.1f queries/s  %7.1f expanded  length %.1f  found %d"
+                      % (name, r['boxes'], r['edges'], r['queries_per_second'], r['mean_expanded'],
+                         r['mean_path_length'] or 0, r['found']))
+            built, merged = results['built'], results['merged']
+            print("  boxes -%.0f%%, edges -%.0f%%, find_path speedup %.2fx"
+                  % (100 * (1 - merged['boxes'] / built['boxes']), 100 * (1 - merged['edges'] / built['edges']),
+                     merged['queries_per_second'] / built['queries_per_second']))
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'build':
+        # nm_benchmark.py build [scale] [max_workers]
+        scale = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+        max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else os.cpu_count()
+        for filename in image_files():
+            image = load_image(filename, scale)
+            timings = benchmark_build(image, 16, worker_counts(max_workers))
+            print("%s x%d (%.1f megapixels)" % (os.path.basename(filename), scale, image.size / 1e6))
+            for n, seconds in timings.items():
+                print("  %-10s %8.3fs  speedup %.2fx" % (n if n == 'serial' else 'tiled/%d' % n,
+                                                        seconds, timings['serial'] / seconds))
+        sys.exit(0)
+
+    queries = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    workers = worker_counts(max_workers)
+
+    for filename in mesh_files():
+        mesh = nm_meshformat.load_mesh(filename)
+        pairs = random_pairs(mesh, queries)
+        timings = benchmark_batch(mesh, pairs, workers)
+
+        print(os.path.basename(filename))
+        for n, seconds in timings.items():
+            print("  workers=%-3d %8.3fs  %9.1f queries/s  speedup %.2fx"
+                  % (n, seconds, queries / seconds, timings[1] / seconds))
+
+        without, with_landmarks = benchmark_landmarks(mesh, pairs)
+        print("  boxes expanded: %.1f euclidean, %.1f with %d landmarks"
+              % (without, with_landmarks, len(mesh['landmarks']['landmarks'])))
+        print("  boxes expanded: %.1f hierarchical" % mean_expanded(mesh, pairs, landmarks=False, hierarchical=True))
@@ -0,0 +1,127 @@
+import random
+import sys
+import time
+
+import nm_meshformat
+import nm_pathfinder
+
+# Flow fields: one search per destination, shared by every agent heading there.
+#
+# A Dijkstra from the destination point (nm_pathfinder.step_rule_search)
+# labels each box of its connected component with the next box toward the
+# destination and the exit point on the portal into that box. Steps follow
+# the pathfinder's rule run backwards (the exit point is the point of the
+# portal closest to the next box's exit point), so the labels are exactly
+# what the backward half of bidirectional_search would compute if it ran to
+# completion. An agent then reads its route off the field by following next
+# pointers, without searching.
+
+DEFAULT_MAX_BOXES = 1000000
+
+
+def build_flow_field(destination_point, mesh):
+    """
+    Labels every box that can reach destination_point with its route toward it.
+
+    Returns a dict with the destination 'point' and 'box', and per box the
+    'next' box (None at the destination), the 'exit' point where the route
+    leaves it and the remaining distance 'dist' from that point. Returns None
+    if the point lies outside the navigable area.
+    """
+    destination_box = nm_pathfinder.find_box(destination_point, mesh)
+    if not destination_box:
+        return None
+    dist, exit_point, next_box = nm_pathfinder.step_rule_search(mesh, destination_box, destination_point)
+    return {'point': destination_point, 'box': destination_box, 'next': next_box, 'exit': exit_point, 'dist': dist}
+
+
+def flow_corridor(field, box):
+    """The boxes from box to the field's destination box, or [] if box cannot reach it."""
+    if box not in field['next']:
+        return []
+    corridor = [box]
+    while field['next'][corridor[-1]] is not None:
+        corridor.append(field['next'][corridor[-1]])
+    return corridor
+
+
+def flow_path(field, source_point, mesh, smooth=False):
+    """
+    The route from source_point to the field's destination, in time proportional to its length.
+
+    Returns (path, corridor); both are empty if source_point is outside the
+    mesh or cannot reach the destination. With smooth=True the path is
+    string-pulled through the corridor's portals, as in find_path.
+    """
+    source_box = nm_pathfinder.find_box(source_point, mesh)
+    if not source_box:
+        return [], []
+    corridor = flow_corridor(field, source_box)
+    if not corridor:
+        return [], []
+    if smooth:
+        portals = nm_pathfinder.corridor_portals(corridor, mesh)
+        return nm_pathfinder.string_pull(portals, source_point, field['point']), corridor
+    return [source_point] + [field['exit'][box] for box in corridor], corridor
+
+
+class FlowFieldCache(nm_pathfinder.BoxBoundedCache):
+    """
+    Bounded LRU cache of flow fields keyed by destination point.
+
+    The bound is on the total number of boxes labelled across all fields
+    (a field over a large component costs more than one over a small one).
+    """
+
+    def __init__(self, max_boxes=DEFAULT_MAX_BOXES):
+        super().__init__(max_boxes, lambda field: len(field['next']))
+
+    def get(self, destination_point, mesh):
+        """The flow field toward destination_point, built on a miss (None if the point is off the mesh)."""
+        self._check_mesh(mesh)
+        field = self._lookup(destination_point)
+        if field is None:
+            field = build_flow_field(destination_point, mesh)
+            if field is not None:
+                self._store(destination_point, field)
+        return field
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3, 4):
+        print("usage: %s map.mesh.(pickle|bin) [num_agents [num_destinations]]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh = nm_meshformat.load_mesh(sys.argv[1])
+    agents = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    destinations = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    nm_pathfinder.box_index(mesh)
+    component = nm_meshformat.component_lookup(mesh)
+
+    # the agents share a few rally points: the centers of the largest boxes of the largest component
+    rng = random.Random(0)
+    largest = max(set(component.values()), key=list(component.values()).count)
+    boxes = [b for b in mesh['boxes'] if component[b] == largest]
+    targets = sorted(boxes, key=lambda b: (b[1] - b[0]) * (b[3] - b[2]), reverse=True)[:destinations]
+    targets = [((b[0] + b[1]) / 2, (b[2] + b[3]) / 2) for b in targets]
+    queries = [((rng.uniform(b[0], b[1]), rng.uniform(b[2], b[3])), rng.choice(targets))
+               for b in rng.choices(boxes, k=agents)]
+
+    start = time.perf_counter()
+    for source, destination in queries:
+        nm_pathfinder.find_path(source, destination, mesh, landmarks=False)
+    searched = time.perf_counter() - start
+
+    cache = FlowFieldCache()
+    start = time.perf_counter()
+    for source, destination in queries:
+        flow_path(cache.get(destination, mesh), source, mesh)
+    followed = time.perf_counter() - start
+
+    stats = cache.stats()
+    print("%d agents to %d destinations over %d boxes:" % (agents, len(targets), len(boxes)))
+    print("  find_path per agent:      %.3fs" % searched)
+    print("  cached flow fields:       %.3fs (%.1f us each, %d fields built)"
+          % (followed, followed / agents * 1e6, stats['misses']))
+    print("  speedup:                  %.1fx" % (searched / followed))
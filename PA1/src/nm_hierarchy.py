@@ -0,0 +1,213 @@
+from heapq import heappop, heappush
+import math
+import sys
+
+import numpy
+
+import nm_meshformat
+import nm_pathfinder
+
+# HPA*-style abstraction over the box graph.
+#
+# Boxes are clustered into regions: boxes whose centres fall in the same square
+# cell of a coarse grid, split further into pieces that are connected inside the
+# cell. Every pair of touching regions gets one entrance, a point on the widest
+# portal between them. The abstract graph links the entrances of each region with
+# the cost of walking between them inside that region. A long query first
+# searches the abstract graph, then the detailed search is confined to the boxes
+# of the regions the abstract path passes through.
+
+DEFAULT_REGION_SIZE = 64
+
+
+def _box_ids(mesh):
+    return {box: i for i, box in enumerate(mesh['boxes'])}
+
+
+def build_regions(mesh, region_size=DEFAULT_REGION_SIZE):
+    """Assigns each box a region id: its grid cell, split into connected pieces."""
+    boxes = list(mesh['boxes'])
+    ids = _box_ids(mesh)
+    cell = [(int((x1 + x2) / 2 // region_size), int((y1 + y2) / 2 // region_size)) for x1, x2, y1, y2 in boxes]
+
+    region = [-1] * len(boxes)
+    count = 0
+    for start in range(len(boxes)):
+        if region[start] >= 0:
+            continue
+        region[start] = count
+        frontier = [start]
+        while frontier:
+            b = frontier.pop()
+            for neighbor in mesh['adj'].get(boxes[b], []):
+                n = ids[neighbor]
+                if region[n] < 0 and cell[n] == cell[start]:
+                    region[n] = count
+                    frontier.append(n)
+        count += 1
+
+    return numpy.asarray(region, dtype=numpy.int32)
+
+
+def _entrance_costs(mesh, members, box, point, entrances):
+    """Walking cost from point (inside box) to each of the given entrances, never leaving the region's members."""
+    dist, points, _ = nm_pathfinder.step_rule_search(mesh, box, point, members)
+    costs = {}
+    for e, entrance_box, entrance_point in entrances:
+        if entrance_box in dist:
+            costs[e] = dist[entrance_box] + math.dist(points[entrance_box], entrance_point)
+    return costs
+
+
+def _region_members(boxes, region):
+    """The set of boxes in each region."""
+    members = {}
+    for box, r in zip(boxes, region):
+        members.setdefault(r, set()).add(box)
+    return members
+
+
+def build_hierarchy(mesh, region_size=DEFAULT_REGION_SIZE):
+    """Clusters the mesh into regions and precomputes the entrance graph between them."""
+    boxes = list(mesh['boxes'])
+    ids = _box_ids(mesh)
+    region = build_regions(mesh, region_size)
+    portals = nm_meshformat.mesh_portals(mesh)
+
+    # one entrance per touching region pair, on the widest portal between them
+    widest = {}
+    for a, box in enumerate(boxes):
+        for neighbor, portal in zip(mesh['adj'].get(box, []), portals.get(box, [])):
+            b = ids[neighbor]
+            if region[a] < region[b]:
+                width = (portal[1] - portal[0]) + (portal[3] - portal[2])
+                key = (int(region[a]), int(region[b]))
+                if key not in widest or width > widest[key][0]:
+                    widest[key] = (width, a, b, portal)
+
+    entrance_regions, entrance_boxes, entrance_points = [], [], []
+    for (ra, rb), (_, a, b, (x1, x2, y1, y2)) in sorted(widest.items()):
+        entrance_regions.append((ra, rb))
+        entrance_boxes.append((a, b))
+        entrance_points.append(((x1 + x2) / 2, (y1 + y2) / 2))
+
+    # for each entrance, the box on each side of it (one per region)
+    region_entrances = {}
+    for e, ((ra, rb), (a, b), point) in enumerate(zip(entrance_regions, entrance_boxes, entrance_points)):
+        region_entrances.setdefault(ra, []).append((e, boxes[a], point))
+        region_entrances.setdefault(rb, []).append((e, boxes[b], point))
+
+    members = _region_members(boxes, region.tolist())
+    edges, edge_costs = [], []
+    for r, entrances in region_entrances.items():
+        for e, box, point in entrances:
+            for f, cost in _entrance_costs(mesh, members[r], box, point, entrances).items():
+                if e < f:
+                    edges.append((e, f))
+                    edge_costs.append(cost)
+
+    return {'region': region,
+            'region_size': numpy.asarray(region_size, dtype=numpy.float64),
+            'entrance_regions': numpy.asarray(entrance_regions, dtype=numpy.int32).reshape(-1, 2),
+            'entrance_boxes': numpy.asarray(entrance_boxes, dtype=numpy.int64).reshape(-1, 2),
+            'entrance_points': numpy.asarray(entrance_points, dtype=numpy.float64).reshape(-1, 2),
+            'edges': numpy.asarray(edges, dtype=numpy.int32).reshape(-1, 2),
+            'edge_costs': numpy.asarray(edge_costs, dtype=numpy.float64)}
+
+
+def _prepare(mesh, hierarchy):
+    """Builds (once) the Python-side lookup tables a query needs from the stored arrays."""
+    if 'graph' in hierarchy:
+        return
+    boxes = mesh['boxes']
+    region = hierarchy['region'].tolist()
+    members = _region_members(boxes, region)
+
+    points = [tuple(p) for p in hierarchy['entrance_points'].tolist()]
+    region_entrances = {}
+    for e, ((ra, rb), (a, b)) in enumerate(zip(hierarchy['entrance_regions'].tolist(),
+                                               hierarchy['entrance_boxes'].tolist())):
+        region_entrances.setdefault(ra, []).append((e, boxes[a], points[e]))
+        region_entrances.setdefault(rb, []).append((e, boxes[b], points[e]))
+
+    graph = [[] for _ in points]
+    for (e, f), cost in zip(hierarchy['edges'].tolist(), hierarchy['edge_costs'].tolist()):
+        graph[e].append((f, cost))
+        graph[f].append((e, cost))
+
+    hierarchy.update({'ids': _box_ids(mesh), 'region_list': region, 'members': members,
+                      'points': points, 'region_entrances': region_entrances, 'graph': graph})
+
+
+def abstract_corridor(source_point, destination_point, source_box, destination_box, mesh):
+    """
+    Searches the entrance graph and returns the boxes of every region the abstract path crosses.
+
+    Returns None when the abstract graph has no route, i.e. the points are not connected.
+    """
+    hierarchy = mesh['hierarchy']
+    _prepare(mesh, hierarchy)
+    ids, region = hierarchy['ids'], hierarchy['region_list']
+    points, graph, region_entrances = hierarchy['points'], hierarchy['graph'], hierarchy['region_entrances']
+    entrance_regions = hierarchy['entrance_regions']
+
+    members = hierarchy['members']
+    rs, rd = region[ids[source_box]], region[ids[destination_box]]
+    if rs == rd:
+        # a direct route inside the region needs no abstract search
+        dist, _, _ = nm_pathfinder.step_rule_search(mesh, source_box, source_point, members[rs])
+        if destination_box in dist:
+            return set(members[rs])
+
+    start = _entrance_costs(mesh, members[rs], source_box, source_point, region_entrances.get(rs, []))
+    goal = _entrance_costs(mesh, members[rd], destination_box, destination_point, region_entrances.get(rd, []))
+
+    # A* over entrances; entry -1 stands for the destination point itself
+    dist, prev = dict(start), {e: None for e in start}
+    queue = [(cost + math.dist(points[e], destination_point), e) for e, cost in start.items()]
+    queue.sort()
+    best, last = math.inf, None
+    closed = set()
+    while queue:
+        f, e = heappop(queue)
+        if f >= best:
+            break
+        if e in closed:
+            continue
+        closed.add(e)
+        if e in goal and dist[e] + goal[e] < best:
+            best, last = dist[e] + goal[e], e
+        for other, cost in graph[e]:
+            if other in closed:
+                continue
+            nd = dist[e] + cost
+            if nd < dist.get(other, math.inf):
+                dist[other] = nd
+                prev[other] = e
+                heappush(queue, (nd + math.dist(points[other], destination_point), other))
+
+    if last is None:
+        return None
+
+    regions = {rs, rd}
+    e = last
+    while e is not None:
+        regions.update(entrance_regions[e].tolist())
+        e = prev[e]
+    return {box for r in regions for box in members[r]}
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s map.mesh.(pickle|bin) [region_size]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh_filename = sys.argv[1]
+    region_size = float(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_REGION_SIZE
+
+    mesh = nm_meshformat.load_mesh(mesh_filename)
+    hierarchy = build_hierarchy(mesh, region_size)
+    out_filename = nm_meshformat.save_sidecar(hierarchy, mesh, mesh_filename, 'hierarchy')
+    print("Wrote %d regions and %d entrances for %d boxes to %s."
+          % (hierarchy['region'].max() + 1, len(hierarchy['entrance_points']), len(mesh['boxes']), out_filename))
@@ -1,20 +1,29 @@
 import sys
 import random
-import pickle
+import threading
 import traceback
 import tkinter
 
 import nm_pathfinder
+import nm_meshformat
 
 if len(sys.argv) != 4:
-    print("usage: %s map.gif map.mesh.pickle subsample_factor" % sys.argv[0])
+    print("usage: %s map.gif map.mesh.(pickle|bin) subsample_factor" % sys.argv[0])
     sys.exit(-1)
 
 _, MAP_FILENAME, MESH_FILENAME, SUBSAMPLE = sys.argv
 SUBSAMPLE = int(SUBSAMPLE)
 
-with open(MESH_FILENAME, 'rb') as f:
-  mesh = pickle.load(f)
+# how often the UI checks on a running search, and how many visited boxes it draws per tick
+POLL_MS = 15
+DRAW_CHUNK = 2000
+
+mesh = nm_meshformat.load_mesh(MESH_FILENAME)
+
+# build the lazily cached lookup tables now rather than inside the first search
+nm_pathfinder.box_index(mesh)
+nm_meshformat.mesh_portals(mesh)
+nm_meshformat.component_lookup(mesh)
 
 master = tkinter.Tk()
 
@@ -25,6 +34,7 @@ SMALL_WIDTH, SMALL_HEIGHT = small_image.width(), small_image.height()
 
 canvas = tkinter.Canvas(master, width=SMALL_WIDTH, height=SMALL_HEIGHT)
 canvas.pack()
+canvas.create_image((0,0), anchor=tkinter.NW, image=small_image, tags='map')
 
 
 def shrink(values):
@@ -32,58 +42,124 @@ def shrink(values):
 
 source_point = None
 destination_point = None
-visited_boxes = []
-path = []
 
+# the search in flight as (thread, cancel event, result dict), and the pending draw callback
+search = None
+drawing = None
 
-def redraw():
 
-    canvas.delete(tkinter.ALL)
-    canvas.create_image((0,0), anchor=tkinter.NW, image=small_image)
+def draw_markers():
+
+    canvas.delete('marker')
+
+    for point in (source_point, destination_point):
+        if point:
+            x,y = shrink(point)
+            canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red',tags='marker')
+
+
+def clear_search():
+    """Cancels the running search, if any, and erases the last result without touching the map."""
+
+    global search, drawing
+
+    if search:
+        search[1].set()
+        search = None
+    if drawing:
+        master.after_cancel(drawing)
+        drawing = None
+    canvas.delete('visited', 'path')
 
-    for box in visited_boxes:
-        x1,x2,y1,y2 = shrink(box)
-        canvas.create_rectangle(y1,x1,y2,x2,outline='pink')
+
+def draw_path(path):
 
     for i in range(len(path) - 1):
         x1, y1 = shrink(path[i])
         x2, y2 = shrink(path[i + 1])
-        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red')
+        canvas.create_line(y1,x1,y2,x2,width=2.0,fill='red',tags='path')
+
+
+def draw_visited(boxes, start=0):
+    """Draws the visited boxes a chunk per tick, below the path and markers, so big searches never stall the UI."""
+
+    global drawing
+
+    for box in boxes[start:start + DRAW_CHUNK]:
+        x1,x2,y1,y2 = shrink(box)
+        canvas.create_rectangle(y1,x1,y2,x2,outline='pink',tags='visited')
+    canvas.tag_raise('path')
+    canvas.tag_raise('marker')
+
+    if start + DRAW_CHUNK < len(boxes):
+        drawing = master.after(1, draw_visited, boxes, start + DRAW_CHUNK)
+    else:
+        drawing = None
+
 
-    if source_point:
-        x,y = shrink(source_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+def start_search():
+    """Runs find_path on a background thread; poll_search picks up the result."""
 
-    if destination_point:
-        x,y = shrink(destination_point)
-        canvas.create_oval(y-5,x-5,y+5,x+5,width=2,outline='red')
+    global search
+
+    cancel = threading.Event()
+    result = {}
+
+    def run(source, destination):
+        try:
+            result['found'] = nm_pathfinder.find_path(source, destination, mesh, cancel=cancel)
+        except:
+            traceback.print_exc()
+
+    thread = threading.Thread(target=run, args=(source_point, destination_point), daemon=True)
+    thread.start()
+    search = (thread, cancel, result)
+    master.after(POLL_MS, poll_search, search)
+
+
+def poll_search(job):
+
+    global search, destination_point
+
+    if job is not search:
+        # cancelled by a newer click
+        return
+    thread, _, result = job
+    if thread.is_alive():
+        master.after(POLL_MS, poll_search, job)
+        return
+
+    search = None
+    if 'found' not in result:
+        destination_point = None
+        draw_markers()
+        return
+
+    path, visited_boxes = result['found']
+    draw_path(path)
+    draw_visited(visited_boxes)
 
 
 def on_click(event):
 
-    global source_point, destination_point, visited_boxes, path
+    global source_point, destination_point
+
+    clear_search()
 
     if source_point and destination_point:
         source_point = None
         destination_point = None
-        visited_boxes = []
-        path = []
 
     elif not source_point:
         source_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
 
     else:
         destination_point = event.y*SUBSAMPLE, event.x*SUBSAMPLE
-        try:
-            path, visited_boxes = nm_pathfinder.find_path(source_point, destination_point, mesh)
-
-        except:
-            destination_point = None
-            traceback.print_exc()
+        start_search()
 
-    redraw()
+    draw_markers()
 
 canvas.bind('<Button-1>', on_click)
 
-redraw()
+draw_markers()
 master.mainloop()
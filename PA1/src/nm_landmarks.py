@@ -0,0 +1,230 @@
+from heapq import heappop, heappush
+import math
+import sys
+
+import numpy
+
+import nm_meshformat
+import nm_pathfinder
+
+# ALT (A*, landmarks, triangle inequality) preprocessing for the navmesh.
+#
+# For each landmark L (the centre of a chosen box) we store, for every box b,
+#   lower[k, b] <= the shortest travel distance from L to any point of b
+#   upper[k, b] >= the shortest travel distance from L to every point of b
+# The lower bound comes from a Dijkstra over the portals: a path from L into b
+# crosses a chain of portals, consecutive ones sharing a box, so the gaps between
+# them (or the straight line from L, if larger) underestimate its length. The
+# upper bound is the length of an actual walk from L plus the size of b.
+# For points p in box u and q in box t the triangle inequality then gives
+#   dist(p, q) >= max(lower[k, t] - upper[k, u], lower[k, u] - upper[k, t]).
+#
+# find_path only uses the tables when asked to (landmarks=True). The portal-gap
+# lower bounds are loose, so on typical maps they prune few boxes, and the
+# per-push loop over the landmarks costs more than the pruning saves.
+
+DEFAULT_LANDMARKS = 8
+
+
+def rect_min_distance(a, b):
+    """Smallest distance between two (x1, x2, y1, y2) rectangles; points and portals are degenerate rectangles."""
+    dx = max(0, a[0] - b[1], b[0] - a[1])
+    dy = max(0, a[2] - b[3], b[2] - a[3])
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def rect_max_distance(a, b):
+    """Largest distance between a point of rectangle a and a point of rectangle b."""
+    dx = max(a[1] - b[0], b[1] - a[0])
+    dy = max(a[3] - b[2], b[3] - a[2])
+    return math.sqrt(dx * dx + dy * dy)
+
+
+def _portal_graph(mesh):
+    """Indexes each undirected portal once: returns (box ids, portal rects, portal -> its two box ids, box -> portal ids)."""
+    boxes = list(mesh['boxes'])
+    ids = {box: i for i, box in enumerate(boxes)}
+    portals = nm_meshformat.mesh_portals(mesh)
+
+    rects, ends = [], []
+    box_portals = [[] for _ in boxes]
+    seen = {}
+    for i, box in enumerate(boxes):
+        for neighbor, rect in zip(mesh['adj'].get(box, []), portals.get(box, [])):
+            j = ids[neighbor]
+            key = (min(i, j), max(i, j))
+            if key not in seen:
+                seen[key] = len(rects)
+                rects.append(rect)
+                ends.append(key)
+            box_portals[i].append(seen[key])
+
+    return ids, rects, ends, box_portals
+
+
+def _lower_bounds(graph, boxes, landmark):
+    """
+    Lower bounds on the travel distance from the landmark box's centre to each portal.
+
+    Stepping between two portals of one box costs at least the gap between
+    them, and no portal is closer than the straight line from the centre, so
+    each label is the larger of the two. Labels never decrease along a step,
+    so a plain Dijkstra settles them.
+    """
+    ids, rects, ends, box_portals = graph
+    x1, x2, y1, y2 = boxes[landmark]
+    centre = ((x1 + x2) / 2, (x1 + x2) / 2, (y1 + y2) / 2, (y1 + y2) / 2)
+
+    dist = [math.inf] * len(rects)
+    queue = []
+    for p in box_portals[landmark]:
+        dist[p] = rect_min_distance(centre, rects[p])
+        heappush(queue, (dist[p], p))
+
+    while queue:
+        d, p = heappop(queue)
+        if d > dist[p]:
+            continue
+        for box in ends[p]:
+            for q in box_portals[box]:
+                nd = max(d + rect_min_distance(rects[p], rects[q]), rect_min_distance(centre, rects[q]))
+                if nd < dist[q]:
+                    dist[q] = nd
+                    heappush(queue, (nd, q))
+
+    lower = numpy.full(len(boxes), numpy.inf)
+    for b in range(len(boxes)):
+        for p in box_portals[b]:
+            lower[b] = min(lower[b], dist[p])
+    lower[landmark] = 0
+    return lower
+
+
+def _upper_bounds(mesh, graph, boxes, landmark):
+    """
+    Upper bounds on the travel distance from the landmark box's centre to every point of each box.
+
+    Runs the pathfinder's own step rule, so every label is the length of a
+    real path; adding the farthest reach inside the box covers all of its points.
+    """
+    ids = graph[0]
+    x1, x2, y1, y2 = start = boxes[landmark]
+    dist, points, _ = nm_pathfinder.step_rule_search(mesh, start, ((x1 + x2) / 2, (y1 + y2) / 2))
+
+    upper = numpy.full(len(boxes), numpy.inf)
+    for box, d in dist.items():
+        x, y = points[box]
+        upper[ids[box]] = d + rect_max_distance((x, x, y, y), box)
+    return upper
+
+
+def landmark_bounds(mesh, landmark, graph=None):
+    """The (lower, upper) distance bound arrays from one landmark box index to every box."""
+    graph = graph or _portal_graph(mesh)
+    boxes = list(mesh['boxes'])
+    return _lower_bounds(graph, boxes, landmark), _upper_bounds(mesh, graph, boxes, landmark)
+
+
+def _components(graph, n):
+    """Connected components of the box graph, as lists of box ids, largest first."""
+    box_portals, ends = graph[3], graph[2]
+    label = [-1] * n
+    components = []
+    for start in range(n):
+        if label[start] >= 0:
+            continue
+        label[start] = len(components)
+        members, frontier = [start], [start]
+        while frontier:
+            b = frontier.pop()
+            for p in box_portals[b]:
+                for other in ends[p]:
+                    if label[other] < 0:
+                        label[other] = len(components)
+                        members.append(other)
+                        frontier.append(other)
+        components.append(members)
+    return sorted(components, key=len, reverse=True)
+
+
+def build_landmarks(mesh, k=DEFAULT_LANDMARKS):
+    """
+    Selects up to k landmark boxes and tabulates their distance bounds to every box.
+
+    Landmarks are shared out between connected components in proportion to
+    their size (components too small for one get none), then placed inside
+    each component by farthest-point selection on the lower bounds.
+    """
+    graph = _portal_graph(mesh)
+    n = len(mesh['boxes'])
+    if not n or k <= 0:
+        return {'landmarks': numpy.zeros(0, dtype=numpy.int64),
+                'lower': numpy.zeros((0, n)), 'upper': numpy.zeros((0, n))}
+    components = _components(graph, n)
+
+    quota = [int(k * len(c) / n) for c in components]
+    if components and not any(quota):
+        quota[0] = 1
+    quota[0] += k - sum(quota)
+
+    chosen, lowers, uppers = [], [], []
+    for members, count in zip(components, quota):
+        if not count:
+            continue
+        # the first landmark is the box farthest from an arbitrary member
+        score, _ = landmark_bounds(mesh, members[0], graph)
+        for j in range(min(count, len(members))):
+            landmark = max(members, key=score.__getitem__)
+            lower, upper = landmark_bounds(mesh, landmark, graph)
+            chosen.append(landmark)
+            lowers.append(lower)
+            uppers.append(upper)
+            score = lower if j == 0 else numpy.minimum(score, lower)
+
+    return {'landmarks': numpy.asarray(chosen, dtype=numpy.int64),
+            'lower': numpy.asarray(lowers).reshape(-1, n),
+            'upper': numpy.asarray(uppers).reshape(-1, n)}
+
+
+def landmark_heuristic(mesh, goal_box, goal_point):
+    """
+    An admissible heuristic (box, point) -> lower bound on the distance to goal_point.
+
+    Returns the plain Euclidean heuristic when the mesh carries no landmark tables.
+    """
+    landmarks = mesh.get('landmarks')
+    if landmarks is None:
+        return lambda box, point: math.dist(point, goal_point)
+
+    ids = landmarks.get('ids')
+    if ids is None:
+        ids = landmarks['ids'] = {box: i for i, box in enumerate(mesh['boxes'])}
+        landmarks['rows'] = list(zip(landmarks['lower'].T.tolist(), landmarks['upper'].T.tolist()))
+
+    rows = landmarks['rows']
+    goal_lower, goal_upper = rows[ids[goal_box]]
+    usable = [i for i in range(len(goal_lower)) if goal_lower[i] < math.inf]
+
+    def heuristic(box, point):
+        lower, upper = rows[ids[box]]
+        h = math.dist(point, goal_point)
+        for i in usable:
+            h = max(h, goal_lower[i] - upper[i], lower[i] - goal_upper[i])
+        return h
+
+    return heuristic
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s map.mesh.(pickle|bin) [num_landmarks]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh_filename = sys.argv[1]
+    k = int(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_LANDMARKS
+
+    mesh = nm_meshformat.load_mesh(mesh_filename)
+    landmarks = build_landmarks(mesh, k)
+    out_filename = nm_meshformat.save_sidecar(landmarks, mesh, mesh_filename, 'landmarks')
+    print("Wrote %d landmarks for %d boxes to %s." % (len(landmarks['landmarks']), len(mesh['boxes']), out_filename))
@@ -1,4 +1,6 @@
 import collections
+import multiprocessing
+import os
 import pickle
 import sys
 import random
@@ -7,143 +9,394 @@ from matplotlib.pyplot import imread, imsave
 import numpy
 from numpy import zeros_like
 
+import nm_meshformat
 
-def build_mesh(image, min_feature_size):
-    def scan(box):
+DEFAULT_TILE_SIZE = 512
 
-        x1, x2, y1, y2 = box
-        area = (x2 - x1) * (y2 - y1)
-
-        if area < min_feature_size or (image[x1:x2, y1:y2] == 255).all() or (image[x1:x2, y1:y2] == 0).all():
-
-            # this box is simple enough to handle in one node
-            if (image[x1:x2, y1:y2] == 255).all():
-                return [box], []
-            else:
-                return [], []
-
-        else:
 
-            # recursively split this big box on the longest dimension
-            if x2 - x1 > y2 - y1:
+def integral_image(mask):
+    """Summed-area table of a 2D mask, padded so that table[x, y] counts mask[:x, :y]."""
+    dtype = numpy.int32 if mask.size < 2**31 else numpy.int64
+    table = numpy.zeros((mask.shape[0] + 1, mask.shape[1] + 1), dtype=dtype)
+    inner = table[1:, 1:]
+    numpy.cumsum(mask, axis=1, dtype=dtype, out=inner)
+    numpy.cumsum(inner, axis=0, out=inner)
+    return table
 
-                cut = int(x1 + (x2 - x1) / 2 + 1)
-                first_box = (x1, cut, y1, y2)
-                second_box = (cut, x2, y1, y2)
 
-                def rank(b): return (b[2], b[3])
+def split_box(box):
+    """Cuts box in half on its longest dimension (y on ties): returns (axis, cut, first half, second half)."""
+    x1, x2, y1, y2 = box
+    if x2 - x1 > y2 - y1:
+        cut = int(x1 + (x2 - x1) / 2 + 1)
+        return 0, cut, (x1, cut, y1, y2), (cut, x2, y1, y2)
+    cut = int(y1 + (y2 - y1) / 2 + 1)
+    return 1, cut, (x1, x2, y1, cut), (x1, x2, cut, y2)
 
-                def first_touch(b): return b[1] == cut
 
-                def second_touch(b): return b[0] == cut
+def is_leaf(box, white_area, min_feature_size):
+    """Whether the builder keeps box whole (as a white box if white_area fills it) instead of splitting it."""
+    x1, x2, y1, y2 = box
+    area = (x2 - x1) * (y2 - y1)
+    # a box without a single white pixel (all black included) cannot yield any boxes,
+    # however far it is split; boxes at most 2 pixels across cannot be cut in two
+    return area < min_feature_size or white_area == area or white_area == 0 or (x2 - x1 <= 2 and y2 - y1 <= 2)
 
-            else:
 
-                cut = int(y1 + (y2 - y1) / 2 + 1)
-                first_box = (x1, x2, y1, cut)
-                second_box = (x1, x2, cut, y2)
+def merge_halves(axis, cut, first, second, merges, stamp):
+    """
+    Joins the (boxes, edges) results of the two halves of a box split at cut.
 
-                def rank(b): return (b[0], b[1])
+    axis is 0 for a cut across x and 1 for a cut across y. Boxes touching the
+    cut line are walked in order along it: equal spans are fused into one box,
+    overlapping spans become edges between the halves. Fused boxes are recorded
+    in merges (old box -> (new box, stamp)) instead of rewriting the edges of
+    the halves; new edges carry the same stamp and resolve_merges applies the
+    fusions once at the end.
+    """
+    first_boxes, first_edges = first
+    second_boxes, second_edges = second
+    if not first_boxes and not second_boxes:
+        return [], []
 
-                def first_touch(b): return b[3] == cut
+    lo = 2 * axis
+    r = 2 - lo
 
-                def second_touch(b): return b[2] == cut
+    def rank(b): return (b[r], b[r + 1])
 
-            first_boxes, first_edges = scan(first_box)
-            second_boxes, second_edges = scan(second_box)
+    my_boxes = [fb for fb in first_boxes if fb[lo + 1] != cut]
+    my_boxes.extend([sb for sb in second_boxes if sb[lo] != cut])
+    my_edges = []
 
-            my_boxes = []
-            my_edges = []
+    first_touches = sorted([fb for fb in first_boxes if fb[lo + 1] == cut], key=rank)
+    second_touches = sorted([sb for sb in second_boxes if sb[lo] == cut], key=rank)
 
-            my_boxes.extend([fb for fb in first_boxes if not first_touch(fb)])
-            my_boxes.extend(
-                [sb for sb in second_boxes if not second_touch(sb)])
+    i = j = 0
+    while i < len(first_touches) and j < len(second_touches):
 
-            first_touches = sorted(filter(first_touch, first_boxes), key=rank)
-            second_touches = sorted(
-                filter(second_touch, second_boxes), key=rank)
+        f, s = first_touches[i], second_touches[j]
+        rf, rs = rank(f), rank(s)
 
-            first_merges = {}
-            second_merges = {}
+        if rf == rs:
 
-            while first_touches and second_touches:
+            i += 1
+            j += 1
+            merged = (f[0], s[1], f[2], s[3])
+            merges[f] = merges[s] = merged, stamp
+            my_boxes.append(merged)
 
-                f, s = first_touches[0], second_touches[0]
-                rf, rs = rank(f), rank(s)
+        elif rf[1] < rs[1]:
 
-                if rf == rs:
+            i += 1
+            my_boxes.append(f)
+            if rf[1] >= rs[0]:
+                my_edges.append((f, s, stamp))
 
-                    first_touches.pop(0)
-                    second_touches.pop(0)
-                    merged = (f[0], s[1], f[2], s[3])
-                    first_merges[f] = merged
-                    second_merges[s] = merged
-                    my_boxes.append(merged)
+        elif rf[1] > rs[1]:
 
-                elif rf[1] < rs[1]:
+            j += 1
+            my_boxes.append(s)
+            if rf[0] <= rs[1]:
+                my_edges.append((f, s, stamp))
 
-                    my_boxes.append(first_touches.pop(0))
-                    if rf[1] >= rs[0]:
-                        my_edges.append((f, s))
-
-                elif rf[1] > rs[1]:
-
-                    my_boxes.append(second_touches.pop(0))
-                    if rf[0] <= rs[1]:
-                        my_edges.append((f, s))
+        else:
 
-                else:
+            i += 1
+            j += 1
+            my_boxes.append(f)
+            my_boxes.append(s)
+            my_edges.append((f, s, stamp))
+
+    my_boxes.extend(first_touches[i:])
+    my_boxes.extend(second_touches[j:])
+
+    my_edges.extend(first_edges)
+    my_edges.extend(second_edges)
+
+    return my_boxes, my_edges
+
+
+def resolve_merges(edges, merges):
+    """
+    Rewrites each edge end to the box it was finally fused into.
+
+    Only fusions from cuts above the one that made the edge apply: an edge
+    made at a cut where one of its ends is fused later in the same walk keeps
+    the unfused box, exactly as the recursive builder produced it.
+    """
+    final = {}
+
+    def resolve(box, stamp):
+        if box not in merges or merges[box][1] == stamp:
+            return box
+        if box not in final:
+            b = box
+            while b in merges:
+                b = merges[b][0]
+            final[box] = b
+        return final[box]
+
+    return [(resolve(a, stamp), resolve(b, stamp)) for a, b, stamp in edges]
+
+
+def scan(image, min_feature_size):
+    """
+    Splits the image into white boxes and the edges between them.
+
+    Boxes that are uniform or smaller than min_feature_size are leaves; others
+    are cut in half on their longest dimension. Uniformity is read from
+    an integral image in O(1), and the split tree is walked with an explicit
+    stack: a box is pushed once to be split and once more to merge the
+    results of its two halves, which sit on top of the results stack by then.
+    """
+    count = integral_image(image == 255).item
+
+    results = []
+    merges = {}
+    cuts = 0
+    stack = [((0, image.shape[0], 0, image.shape[1]), None)]
+    while stack:
+        box, split = stack.pop()
+
+        if split is not None:
+            second = results.pop()
+            first = results.pop()
+            cuts += 1
+            results.append(merge_halves(split[0], split[1], first, second, merges, cuts))
+            continue
 
-                    my_boxes.append(first_touches.pop(0))
-                    my_boxes.append(second_touches.pop(0))
-                    my_edges.append((f, s))
+        x1, x2, y1, y2 = box
+        white_area = count(x2, y2) - count(x1, y2) - count(x2, y1) + count(x1, y1)
 
-            my_boxes.extend(first_touches)
-            my_boxes.extend(second_touches)
+        if is_leaf(box, white_area, min_feature_size):
 
-            for a, b in first_edges:
-                my_edges.append(
-                    (first_merges.get(a, a), first_merges.get(b, b)))
+            # this box is simple enough to handle in one node
+            results.append(([box], []) if white_area == (x2 - x1) * (y2 - y1) else ([], []))
 
-            for a, b in second_edges:
-                my_edges.append(
-                    (second_merges.get(a, a), second_merges.get(b, b)))
+        else:
 
-            return my_boxes, my_edges
+            axis, cut, first_box, second_box = split_box(box)
+            stack.append((box, (axis, cut)))
+            stack.append((second_box, None))
+            stack.append((first_box, None))
 
-            # end of scan
+    boxes, edges = results[0]
+    return boxes, resolve_merges(edges, merges)
 
-    boxes, edges = scan((0, image.shape[0], 0, image.shape[1]))
 
+def mesh_from_edges(edges):
+    """Assembles the mesh dict (boxes in order of first appearance in edges) and caches its portals and components."""
     adj = collections.defaultdict(list)
     for a, b in edges:
         adj[a].append(b)
         adj[b].append(a)
 
     mesh = {'boxes': list(adj.keys()), 'adj': dict(adj)}
+    nm_meshformat.mesh_portals(mesh)
+    nm_meshformat.mesh_components(mesh)
 
     return mesh
 
 
+def touching_pairs(boxes):
+    """
+    Every pair of boxes that share an edge or a corner, for boxes that do not overlap.
+
+    Boxes are filed by the line their low x and low y edges lie on, so only
+    the boxes starting where a box ends need to be checked. Corner contacts
+    are found along x only, so no pair is listed twice.
+    """
+    by_x, by_y = collections.defaultdict(list), collections.defaultdict(list)
+    for box in boxes:
+        by_x[box[0]].append(box)
+        by_y[box[2]].append(box)
+    for line in (by_x, by_y):
+        for row in line.values():
+            row.sort(key=lambda b: b[2] if line is by_x else b[0])
+
+    pairs = []
+    for a in boxes:
+        for b in by_x.get(a[1], []):
+            if b[2] > a[3]:
+                break
+            if b[3] >= a[2]:
+                pairs.append((a, b))
+        for b in by_y.get(a[3], []):
+            if b[0] >= a[1]:
+                break
+            if b[1] > a[0]:
+                pairs.append((a, b))
+    return pairs
+
+
+def cover_rectangles(covered, xs, ys):
+    """
+    Greedily covers the True cells of a grid with rectangles, in (x1, x2, y1, y2) coordinates xs and ys.
+
+    Cells are claimed in row-major order: a rectangle starts at the first
+    free cell, runs along the row as far as it can, and then grows down
+    while the whole run below is free.
+    """
+    free = covered.copy()
+    rectangles = []
+    for i in range(free.shape[0]):
+        for j in numpy.flatnonzero(free[i]).tolist():
+            if not free[i, j]:
+                continue
+            row = free[i, j:]
+            j2 = j + (int(numpy.argmin(row)) if not row.all() else len(row))
+            i2 = i + 1
+            while i2 < free.shape[0] and free[i2, j:j2].all():
+                i2 += 1
+            free[i:i2, j:j2] = False
+            rectangles.append((xs[i], xs[i2], ys[j], ys[j2]))
+    return rectangles
+
+
+def merge_boxes(mesh):
+    """
+    Optional post-pass: recovers the mesh's area with fewer, larger boxes and rebuilds the mesh around them.
+
+    The builder only fuses boxes that meet with equal spans on the cut that
+    separates them, so the area is left in pieces wherever the split tree
+    cut through it. Here the area covered by the boxes is laid on a grid of
+    the box edge coordinates and covered again greedily with maximal
+    rectangles, running along x first and along y first, keeping whichever
+    gives fewer boxes. Adjacency is recomputed from the geometry, so the
+    edges are exactly the touching pairs, corners included. Returns a new
+    mesh; boxes left without neighbors stay out of it, as in build_mesh.
+    """
+    boxes = numpy.asarray(mesh['boxes'], dtype=numpy.int64).reshape(-1, 4)
+    xs, ys = numpy.unique(boxes[:, :2]), numpy.unique(boxes[:, 2:])
+    rows, cols = numpy.searchsorted(xs, boxes[:, :2]), numpy.searchsorted(ys, boxes[:, 2:])
+    covered = numpy.zeros((max(len(xs) - 1, 0), max(len(ys) - 1, 0)), dtype=bool)
+    for (i1, i2), (j1, j2) in zip(rows.tolist(), cols.tolist()):
+        covered[i1:i2, j1:j2] = True
+
+    xs, ys = xs.tolist(), ys.tolist()
+    along_y = cover_rectangles(covered, xs, ys)
+    along_x = [(x1, x2, y1, y2) for y1, y2, x1, x2 in cover_rectangles(covered.T, ys, xs)]
+    return mesh_from_edges(touching_pairs(min(along_y, along_x, key=len)))
+
+
+def build_mesh(image, min_feature_size, merge=False):
+    """Builds the navmesh of an image; merge=True adds the merge_boxes pass."""
+    boxes, edges = scan(image, min_feature_size)
+    mesh = mesh_from_edges(edges)
+    return merge_boxes(mesh) if merge else mesh
+
+
+def scan_region(pixels, min_feature_size, box):
+    """
+    scan for the part of an image covered by box, given just its pixels, in image coordinates.
+
+    The result is the subtree of the full image's split tree rooted at box,
+    since the cuts depend only on a box's size, not on where it sits.
+    """
+    x0, y0 = box[0], box[2]
+    boxes, edges = scan(pixels, min_feature_size)
+
+    def move(b): return b[0] + x0, b[1] + x0, b[2] + y0, b[3] + y0
+
+    return [move(b) for b in boxes], [(move(a), move(b)) for a, b in edges]
+
+
+def _scan_tile(task):
+    """Pool task: scan_region for one tile, with edges stamped for resolve_merges."""
+    pixels, box, min_feature_size = task
+    boxes, edges = scan_region(pixels, min_feature_size, box)
+    return boxes, [(a, b, 0) for a, b in edges]
+
+
+def build_mesh_tiled(image, min_feature_size, tile_size=DEFAULT_TILE_SIZE, workers=None):
+    """
+    build_mesh with the image split into tiles scanned in a process pool; the result is identical.
+
+    Tiles are the nodes of the builder's own split tree once they are at most
+    tile_size pixels across, so every tile is scanned exactly as the serial
+    walk would scan it (see scan_region). The parent then replays the cuts
+    above the tiles, stitching boxes and edges across each tile seam with the
+    same merge step.
+    """
+    workers = workers or os.cpu_count() or 1
+
+    # walk the top of the split tree, recording the post-order of tiles, leaves and cuts
+    tiles, plan = [], []
+    stack = [((0, image.shape[0], 0, image.shape[1]), None)]
+    while stack:
+        box, split = stack.pop()
+        if split is not None:
+            plan.append(('cut', split))
+            continue
+
+        x1, x2, y1, y2 = box
+        if x2 - x1 <= tile_size and y2 - y1 <= tile_size:
+            plan.append(('tile', len(tiles)))
+            tiles.append((image[x1:x2, y1:y2], box, min_feature_size))
+            continue
+
+        white_area = int(numpy.count_nonzero(image[x1:x2, y1:y2] == 255))
+        if is_leaf(box, white_area, min_feature_size):
+            plan.append(('leaf', ([box], []) if white_area == (x2 - x1) * (y2 - y1) else ([], [])))
+        else:
+            axis, cut, first_box, second_box = split_box(box)
+            stack.append((box, (axis, cut)))
+            stack.append((second_box, None))
+            stack.append((first_box, None))
+
+    if workers > 1 and len(tiles) > 1:
+        with multiprocessing.Pool(min(workers, len(tiles))) as pool:
+            scanned = pool.map(_scan_tile, tiles, chunksize=1)
+    else:
+        scanned = [_scan_tile(tile) for tile in tiles]
+
+    # tile edges are resolved already; stamp 0 lets every seam fusion (stamps from 1) apply to them
+    results = []
+    merges = {}
+    cuts = 0
+    for kind, value in plan:
+        if kind == 'tile':
+            results.append(scanned[value])
+        elif kind == 'leaf':
+            results.append(value)
+        else:
+            second = results.pop()
+            first = results.pop()
+            cuts += 1
+            results.append(merge_halves(value[0], value[1], first, second, merges, cuts))
+
+    boxes, edges = results[0]
+    return mesh_from_edges(resolve_merges(edges, merges))
+
+
 if __name__ == '__main__':
 
     min_feature_size = 16
+    workers = 1
     filename = None
 
-    if len(sys.argv) == 2:
-        filename = sys.argv[1]
-    elif len(sys.argv) == 3:
-        filename = sys.argv[1]
-        min_feature_size = int(sys.argv[2])
+    merge = '--merge' in sys.argv[1:]
+    args = [arg for arg in sys.argv[1:] if arg != '--merge']
+    if len(args) in (1, 2, 3):
+        filename = args[0]
+        if len(args) > 1:
+            min_feature_size = int(args[1])
+        if len(args) > 2:
+            workers = int(args[2])
     else:
-        print("usage: %s map_filename min_feature_size" % sys.argv[0])
+        print("usage: %s [--merge] map_filename [min_feature_size [workers]]" % sys.argv[0])
         sys.exit(-1)
 
     img = (imread(filename) * 255).astype(dtype=numpy.uint8)
     if len(img.shape) > 2:
         img = img[:, :, 0]
 
-    mesh = build_mesh(img, min_feature_size)
+    if workers > 1:
+        mesh = build_mesh_tiled(img, min_feature_size, workers=workers)
+    else:
+        mesh = build_mesh(img, min_feature_size)
+    if merge:
+        mesh = merge_boxes(mesh)
 
     print(type(mesh))
     print(mesh.keys())
@@ -151,6 +404,10 @@ if __name__ == '__main__':
     with open(filename + '.mesh.pickle', 'wb') as f:
         pickle.dump(mesh, f, protocol=pickle.HIGHEST_PROTOCOL)
 
+    nm_meshformat.save_mesh_arrays(mesh, filename + '.mesh.bin')
+    nm_meshformat.remove_sidecars(filename + '.mesh.pickle')
+    nm_meshformat.remove_sidecars(filename + '.mesh.bin')
+
     atlas = zeros_like(img)
     for x1, x2, y1, y2 in mesh['boxes']:
         atlas[x1:x2, y1:y2] = random.randint(64, 255)
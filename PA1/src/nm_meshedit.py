@@ -0,0 +1,322 @@
+import collections
+import sys
+import time
+
+from matplotlib.pyplot import imread
+import numpy
+
+import nm_meshbuilder
+import nm_meshformat
+
+# Incremental navmesh updates for edits to a small rectangle of the map image.
+#
+# The editor keeps a raster next to the mesh giving the box that covers each
+# pixel. An edit rescans just the edited rectangle with the builder, cuts the
+# boxes that overlapped it down to their (unchanged) parts outside it, and
+# reconnects the new boxes to each other and to the untouched boxes around
+# them. The box list, its spatial index and the component labels are patched
+# for the boxes that changed too, so the work (including the first query after
+# an edit) is proportional to the edited area and its surroundings, not to the
+# map.
+
+
+def touching(a, b):
+    """Whether two (x1, x2, y1, y2) boxes share an edge or a corner (or overlap)."""
+    return a[0] <= b[1] and b[0] <= a[1] and a[2] <= b[3] and b[2] <= a[3]
+
+
+def clip_outside(box, region):
+    """The parts of box outside region, as up to four boxes."""
+    x1, x2, y1, y2 = box
+    rx1, rx2, ry1, ry2 = max(region[0], x1), min(region[1], x2), max(region[2], y1), min(region[3], y2)
+    if rx1 >= rx2 or ry1 >= ry2:
+        return [box]
+    parts = [(x1, rx1, y1, y2), (rx2, x2, y1, y2), (rx1, rx2, y1, ry1), (rx1, rx2, ry2, y2)]
+    return [(a, b, c, d) for a, b, c, d in parts if a < b and c < d]
+
+
+def _box_buckets(index, box):
+    """The buckets box overlaps, or None if it reaches outside the index grid."""
+    x_lo, y_lo = index['origin']
+    cell_size = index['cell_size']
+    rows, cols = index['shape']
+    r1, r2 = int((box[0] - x_lo) // cell_size), int((box[1] - x_lo) // cell_size)
+    c1, c2 = int((box[2] - y_lo) // cell_size), int((box[3] - y_lo) // cell_size)
+    if r1 < 0 or c1 < 0 or r2 >= rows or c2 >= cols:
+        return None
+    return [r * cols + c for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)]
+
+
+def replace_boxes(mesh, removed, added, ids):
+    """
+    Removes and adds boxes in place in the list mesh['boxes'], patching its spatial index to match.
+
+    ids maps each box of the list to its position and is kept up to date.
+    The last box of the list fills each removed box's slot, so a removal
+    moves at most one other box and the work is proportional to the boxes
+    changed. The index's packed arrays (used by nm_pathfinder.find_boxes)
+    are only repacked when next needed; an added box outside the index's
+    grid drops the index, to be rebuilt on next use.
+    """
+    boxes = mesh['boxes']
+    index = mesh.get('box_index')
+    if index is not None and (index['source'] is not boxes or index['count'] != len(boxes)):
+        index = None
+    buckets = index['buckets'] if index is not None else None
+
+    for box in removed:
+        i = ids.pop(box)
+        last = boxes.pop()
+        if buckets is not None:
+            for b in _box_buckets(index, box):
+                buckets[b].remove(i)
+        if i < len(boxes):
+            boxes[i] = last
+            ids[last] = i
+            if buckets is not None:
+                for b in _box_buckets(index, last):
+                    bucket = buckets[b]
+                    bucket[bucket.index(len(boxes))] = i
+
+    for box in added:
+        ids[box] = len(boxes)
+        boxes.append(box)
+        if buckets is not None:
+            overlapped = _box_buckets(index, box)
+            if overlapped is None:
+                buckets = None
+            else:
+                for b in overlapped:
+                    buckets[b].append(ids[box])
+
+    if buckets is None:
+        mesh.pop('box_index', None)
+    else:
+        index.update({'count': len(boxes), 'array': None, 'offsets': None, 'items': None})
+
+
+def update_components(mesh, removed, around):
+    """
+    Patches the component labels after boxes were removed and the adjacency changed only among around.
+
+    around holds the added boxes and every remaining box next to the change.
+    Regrouping around by its new connections shows what happened locally:
+    added boxes join the component they touch, or a new one; components
+    joined by the change are merged by relabeling all but the largest. If
+    boxes of one component end up in different groups, it may have been cut
+    in two, and the labels are dropped to be recomputed on next use. Either
+    way the labels array is dropped and rebuilt by mesh_components on demand.
+    """
+    components = mesh.get('components')
+    if components is None or 'of' not in components:
+        mesh.pop('components', None)
+        return
+    of, adj = components['of'], mesh['adj']
+    if 'sizes' not in components:
+        components['sizes'] = collections.Counter(of.values())
+        components['next'] = max(of.values(), default=-1) + 1
+    sizes = components['sizes']
+    components['labels'] = None
+
+    for box in removed:
+        sizes[of.pop(box)] -= 1
+
+    local = {box for box in around if box in adj}
+    groups, seen = [], set()
+    for start in local:
+        if start in seen:
+            continue
+        seen.add(start)
+        group, frontier = [start], [start]
+        while frontier:
+            for neighbor in adj[frontier.pop()]:
+                if neighbor in local and neighbor not in seen:
+                    seen.add(neighbor)
+                    group.append(neighbor)
+                    frontier.append(neighbor)
+        groups.append(group)
+
+    owner = {}
+    for k, group in enumerate(groups):
+        for label in {of[box] for box in group if box in of}:
+            if owner.setdefault(label, k) != k:
+                mesh.pop('components')
+                return
+
+    for group in groups:
+        labels = {of[box] for box in group if box in of}
+        if labels:
+            keep = max(labels, key=sizes.__getitem__)
+        else:
+            keep = components['next']
+            components['next'] += 1
+        for label in labels - {keep}:
+            frontier = [box for box in group if of.get(box) == label]
+            for box in frontier:
+                of[box] = keep
+            while frontier:
+                for neighbor in adj[frontier.pop()]:
+                    if of.get(neighbor) == label:
+                        of[neighbor] = keep
+                        frontier.append(neighbor)
+            sizes[keep] += sizes.pop(label)
+        for box in group:
+            if box not in of:
+                of[box] = keep
+                sizes[keep] += 1
+
+
+class MeshEditor:
+    """
+    A mesh built from an image, kept up to date as rectangles of the image change.
+
+    The mesh is built once up front (exactly as build_mesh would) and then
+    patched in place by edit(). Patched meshes are valid decompositions of
+    the new image but need not be box-for-box what a full rebuild gives.
+    """
+
+    def __init__(self, image, min_feature_size):
+        self.image = image
+        self.min_feature_size = min_feature_size
+        self.labels = numpy.full(image.shape, -1, dtype=numpy.int32)
+        # label -> box for the boxes painted on self.labels; an edit removes the boxes it replaces
+        self.boxes = {}
+        self.next_label = 0
+        self.inside = {}
+
+        boxes, edges = nm_meshbuilder.scan(image, min_feature_size)
+        self.mesh = nm_meshbuilder.mesh_from_edges(edges)
+        self.ids = {box: i for i, box in enumerate(self.mesh['boxes'])}
+        nm_meshformat.component_lookup(self.mesh)
+        self._paint(boxes, edges)
+
+    def _paint(self, boxes, edges):
+        """Labels the pixels of new boxes, and files the unfused boxes edges may still name under their fused box."""
+        for box in boxes:
+            x1, x2, y1, y2 = box
+            self.labels[x1:x2, y1:y2] = self.next_label
+            self.boxes[self.next_label] = box
+            self.next_label += 1
+        known = set(boxes)
+        for edge in edges:
+            for box in edge:
+                if box not in known:
+                    known.add(box)
+                    container = self.boxes[int(self.labels[box[0], box[2]])]
+                    self.inside.setdefault(container, []).append(box)
+
+    @staticmethod
+    def _labels_in(labels):
+        return [i for i in numpy.unique(labels).tolist() if i >= 0]
+
+    def _ring(self, region):
+        """The boxes covering the one-pixel ring just outside region."""
+        x1, x2, y1, y2 = region
+        h, w = self.labels.shape
+        X1, X2, Y1, Y2 = max(x1 - 1, 0), min(x2 + 1, h), max(y1 - 1, 0), min(y2 + 1, w)
+        ring = numpy.concatenate([self.labels[X1:X2, Y1], self.labels[X1:X2, Y2 - 1],
+                                  self.labels[X1, Y1:Y2], self.labels[X2 - 1, Y1:Y2]])
+        return [self.boxes[i] for i in self._labels_in(ring)]
+
+    def edit(self, region, pixels=None):
+        """
+        Updates the mesh after the (x1, x2, y1, y2) rectangle of the image changed.
+
+        If pixels (an array or a single value) is given it is written into
+        that rectangle first; otherwise the caller has already changed
+        self.image there. Returns the lists of (removed, added) boxes.
+        mesh['boxes'] (the same list object), its spatial index and the
+        component labels are patched in place. Landmark and hierarchy tables
+        no longer match the mesh and are dropped; mesh['version'] is bumped
+        so path caches notice the change.
+        """
+        h, w = self.image.shape
+        x1, x2, y1, y2 = region = max(region[0], 0), min(region[1], h), max(region[2], 0), min(region[3], w)
+        if pixels is not None:
+            self.image[x1:x2, y1:y2] = pixels
+        if x1 >= x2 or y1 >= y2:
+            return [], []
+
+        adj, portals = self.mesh['adj'], nm_meshformat.mesh_portals(self.mesh)
+        removed_labels = self._labels_in(self.labels[x1:x2, y1:y2])
+        removed = [self.boxes[i] for i in removed_labels]
+        # the old boxes, with any unfused boxes that still stand in for them
+        gone = removed + [b for box in removed for b in self.inside.pop(box, [])]
+        outside = set(self._ring(region)).difference(gone)
+        # their pixels are all relabeled below: inside the edit by the rescan, outside it by their pieces
+        for i in removed_labels:
+            del self.boxes[i]
+
+        for box in gone:
+            for neighbor in adj.pop(box, []):
+                if neighbor in adj:
+                    adj[neighbor].remove(box)
+                    outside.add(neighbor)
+            portals.pop(box, None)
+
+        outside.difference_update(gone)
+
+        # the parts of the old boxes outside the edit are still white, so they stay as they are
+        pieces = [piece for box in removed for piece in clip_outside(box, region)]
+        self.labels[x1:x2, y1:y2] = -1
+        boxes, edges = nm_meshbuilder.scan_region(self.image[x1:x2, y1:y2], self.min_feature_size, region)
+        self._paint(boxes + pieces, edges)
+
+        # reconnect the rescanned boxes on the border of the edit, the kept pieces and the boxes around them
+        border = [b for b in boxes if b[0] == x1 or b[1] == x2 or b[2] == y1 or b[3] == y2]
+        for i, a in enumerate(pieces):
+            edges.extend((a, b) for b in border + pieces[i + 1:] if touching(a, b))
+        for a in outside:
+            edges.extend((a, b) for b in border + pieces if touching(a, b))
+
+        touched = set(outside)
+        for a, b in edges:
+            adj.setdefault(a, []).append(b)
+            adj.setdefault(b, []).append(a)
+            touched.update((a, b))
+
+        for box in touched:
+            if box not in adj:
+                continue
+            if adj[box]:
+                portals[box] = [nm_meshformat.portal(box, neighbor) for neighbor in adj[box]]
+            else:
+                # like build_mesh, boxes without neighbors stay out of the mesh
+                del adj[box]
+                portals.pop(box, None)
+
+        # the boxes that left or joined the mesh, with any kept box whose neighbors changed
+        changed = touched.union(gone)
+        left = [box for box in changed if box in self.ids and box not in adj]
+        joined = [box for box in changed if box in adj and box not in self.ids]
+        replace_boxes(self.mesh, left, joined, self.ids)
+        update_components(self.mesh, left, touched)
+        for kind in ('landmarks', 'hierarchy'):
+            self.mesh.pop(kind, None)
+        self.mesh['version'] = self.mesh.get('version', 0) + 1
+        return removed, boxes + pieces
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 7:
+        print("usage: %s map_filename x1 x2 y1 y2 value" % sys.argv[0])
+        sys.exit(-1)
+
+    img = (imread(sys.argv[1]) * 255).astype(dtype=numpy.uint8)
+    if len(img.shape) > 2:
+        img = img[:, :, 0]
+    region = tuple(int(v) for v in sys.argv[2:6])
+    value = int(sys.argv[6])
+
+    editor = MeshEditor(img, 16)
+
+    start = time.perf_counter()
+    removed, added = editor.edit(region, value)
+    elapsed = time.perf_counter() - start
+    print("Incremental edit: %.4fs, %d boxes removed, %d added, %d boxes in the mesh."
+          % (elapsed, len(removed), len(added), len(editor.mesh['boxes'])))
+
+    start = time.perf_counter()
+    mesh = nm_meshbuilder.build_mesh(editor.image, 16)
+    print("Full rebuild: %.4fs, %d boxes." % (time.perf_counter() - start, len(mesh['boxes'])))
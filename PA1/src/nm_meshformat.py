@@ -0,0 +1,409 @@
+import collections.abc
+import hashlib
+import os
+import pickle
+import struct
+import sys
+
+import numpy
+
+# File layout (little endian):
+#   header   64 bytes: magic, number of boxes, number of neighbor entries, box dtype
+#   boxes    N x 4 array of (x1, x2, y1, y2) in the box dtype (int32, or float64 for fractional meshes)
+#   offsets  N + 1 int64, CSR row pointers into neighbors
+#   neighbors  int32 box indices, the neighbors of box i are neighbors[offsets[i]:offsets[i + 1]]
+MAGIC = b'NMESH\x00\x01\x00'
+HEADER = struct.Struct('<8sqq8s')
+HEADER_SIZE = 64
+
+
+def _layout(n_boxes, n_neighbors, dtype):
+    """Byte offsets of the boxes, offsets and neighbors sections, and the file size, for the given counts."""
+    boxes_offset = HEADER_SIZE
+    offsets_offset = boxes_offset + n_boxes * 4 * numpy.dtype(dtype).itemsize
+    neighbors_offset = offsets_offset + (n_boxes + 1) * 8
+    return boxes_offset, offsets_offset, neighbors_offset, neighbors_offset + n_neighbors * 4
+
+
+def _header(n_boxes, n_neighbors, dtype):
+    return HEADER.pack(MAGIC, n_boxes, n_neighbors, numpy.dtype(dtype).str.encode('ascii')).ljust(HEADER_SIZE, b'\x00')
+
+
+def mesh_to_arrays(mesh):
+    """Converts a dict mesh into (boxes, offsets, neighbors) arrays, keeping mesh['boxes'] order."""
+    if 'arrays' in mesh:
+        arrays = mesh['arrays']
+        return arrays['boxes'], arrays['offsets'], arrays['neighbors']
+
+    box_list = list(mesh['boxes'])
+    ids = {box: i for i, box in enumerate(box_list)}
+
+    values = numpy.asarray(box_list, dtype=numpy.float64).reshape(-1, 4)
+    integral = (values == numpy.round(values)).all() and numpy.abs(values).max(initial=0) < 2**31
+    boxes = values.astype(numpy.int32 if integral else numpy.float64)
+
+    offsets = numpy.zeros(len(box_list) + 1, dtype=numpy.int64)
+    neighbors = []
+    for i, box in enumerate(box_list):
+        row = mesh['adj'].get(box, [])
+        neighbors.extend(ids[n] for n in row)
+        offsets[i + 1] = offsets[i] + len(row)
+
+    return boxes, offsets, numpy.asarray(neighbors, dtype=numpy.int32)
+
+
+def save_mesh_arrays(mesh, filename):
+    """Writes a mesh (dict or array-backed) to filename in the binary format."""
+    boxes, offsets, neighbors = mesh_to_arrays(mesh)
+    dtype = numpy.dtype(boxes.dtype).newbyteorder('<')
+
+    sections = _layout(len(boxes), len(neighbors), dtype)
+
+    with open(filename, 'wb') as f:
+        f.write(_header(len(boxes), len(neighbors), dtype))
+        for offset, array, section_dtype in zip(sections, (boxes, offsets, neighbors), (dtype, '<i8', '<i4')):
+            f.seek(offset)
+            f.write(numpy.ascontiguousarray(array, dtype=section_dtype).tobytes())
+
+
+def assemble_mesh_file(filename, boxes, edges, chunk_size=1 << 20):
+    """
+    Writes a binary mesh file from an N x 4 box array and an E x 2 array of undirected edges (box index pairs).
+
+    Both inputs may be memory-mapped; they are read chunk_size rows at a
+    time and the CSR arrays are filled in place in the output file, so
+    memory use stays bounded however large the mesh is.
+    """
+    n_boxes, n_neighbors = len(boxes), 2 * len(edges)
+    dtype = numpy.dtype(boxes.dtype).newbyteorder('<')
+    boxes_offset, offsets_offset, neighbors_offset, size = _layout(n_boxes, n_neighbors, dtype)
+
+    with open(filename, 'wb') as f:
+        f.write(_header(n_boxes, n_neighbors, dtype))
+        f.truncate(size)
+
+    def view(dtype, offset, shape):
+        return numpy.memmap(filename, dtype=dtype, mode='r+', offset=offset, shape=shape)
+
+    out_boxes = view(dtype, boxes_offset, (n_boxes, 4)) if n_boxes else numpy.zeros((0, 4), dtype)
+    for i in range(0, n_boxes, chunk_size):
+        out_boxes[i:i + chunk_size] = boxes[i:i + chunk_size]
+
+    # row lengths, then row pointers
+    offsets = view('<i8', offsets_offset, (n_boxes + 1,))
+    offsets[:] = 0
+    for i in range(0, len(edges), chunk_size):
+        numpy.add.at(offsets, numpy.asarray(edges[i:i + chunk_size]).ravel() + 1, 1)
+    numpy.cumsum(offsets, out=offsets)
+
+    # scatter both directions of each edge to the next free slot of its row
+    if n_neighbors:
+        neighbors = view('<i4', neighbors_offset, (n_neighbors,))
+        cursor = numpy.array(offsets[:-1])
+        for i in range(0, len(edges), chunk_size):
+            chunk = numpy.asarray(edges[i:i + chunk_size])
+            source = numpy.concatenate([chunk[:, 0], chunk[:, 1]])
+            target = numpy.concatenate([chunk[:, 1], chunk[:, 0]])
+            order = numpy.argsort(source, kind='stable')
+            source, target = source[order], target[order]
+            rank = numpy.arange(len(source)) - numpy.searchsorted(source, source)
+            neighbors[cursor[source] + rank] = target
+            rows, counts = numpy.unique(source, return_counts=True)
+            cursor[rows] += counts
+        neighbors.flush()
+    if n_boxes:
+        out_boxes.flush()
+    offsets.flush()
+
+
+def load_mesh_arrays(filename):
+    """Memory-maps the arrays of a binary mesh file without reading them."""
+    with open(filename, 'rb') as f:
+        magic, n_boxes, n_neighbors, dtype = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("%s is not a binary navmesh file" % filename)
+
+    dtype = numpy.dtype(dtype.rstrip(b'\x00').decode('ascii'))
+    boxes_offset, offsets_offset, neighbors_offset, _ = _layout(n_boxes, n_neighbors, dtype)
+
+    def view(dtype, offset, shape):
+        if not numpy.prod(shape):
+            return numpy.zeros(shape, dtype=dtype)
+        return numpy.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+    return {'boxes': view(dtype, boxes_offset, (n_boxes, 4)),
+            'offsets': view('<i8', offsets_offset, (n_boxes + 1,)),
+            'neighbors': view('<i4', neighbors_offset, (n_neighbors,))}
+
+
+class BoxSequence(collections.abc.Sequence):
+    """Read-only list of box tuples backed by an N x 4 array."""
+
+    def __init__(self, boxes):
+        self.array = boxes
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [tuple(row) for row in self.array[i].tolist()]
+        return tuple(self.array[i].tolist())
+
+
+class CSRAdjacency(collections.abc.Mapping):
+    """
+    The mesh['adj'] dict interface (box tuple -> list of neighbor box tuples) over CSR arrays.
+
+    The box -> row lookup table is only built on first access, so opening a mesh stays cheap.
+    """
+
+    def __init__(self, boxes, offsets, neighbors):
+        self.boxes = BoxSequence(boxes)
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self._ids = None
+
+    def row(self, box):
+        if self._ids is None:
+            self._ids = {box: i for i, box in enumerate(map(tuple, self.boxes.array.tolist()))}
+        return self._ids[box]
+
+    def neighbor_ids(self, i):
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, box):
+        return [tuple(row) for row in self.boxes.array[self.neighbor_ids(self.row(box))].tolist()]
+
+    def __contains__(self, box):
+        try:
+            self.row(box)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.boxes)
+
+    def __len__(self):
+        return len(self.boxes)
+
+
+class CSRPortals(collections.abc.Mapping):
+    """mesh['portals'] view (box tuple -> list of portal tuples, parallel to mesh['adj'][box]) over an E x 4 array."""
+
+    def __init__(self, adj, portals):
+        self.adj = adj
+        self.array = portals
+
+    def __getitem__(self, box):
+        i = self.adj.row(box)
+        return [tuple(row) for row in self.array[self.adj.offsets[i]:self.adj.offsets[i + 1]].tolist()]
+
+    def __iter__(self):
+        return iter(self.adj)
+
+    def __len__(self):
+        return len(self.adj)
+
+
+def portal(a, b):
+    """The shared edge of two touching boxes, as a degenerate (x1, x2, y1, y2) box: a segment or a corner point."""
+    return max(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), min(a[3], b[3])
+
+
+def mesh_portals(mesh):
+    """
+    The portal between every pair of adjacent boxes, computed once and cached as mesh['portals'].
+
+    Returns a mapping from each box to the list of portals leading to its neighbors, in the same
+    order as mesh['adj'][box]. Array-backed meshes get the whole E x 4 portal array in one pass.
+    """
+    if mesh.get('portals') is None:
+        mesh['portals'] = compute_portals(mesh)
+    return mesh['portals']
+
+
+def compute_portals(mesh):
+    """Builds the mesh_portals mapping from scratch."""
+    if 'arrays' in mesh:
+        boxes, offsets, neighbors = mesh_to_arrays(mesh)
+        rows = numpy.repeat(numpy.arange(len(boxes)), numpy.diff(offsets))
+        a, b = boxes[rows], boxes[neighbors]
+        portals = numpy.stack([numpy.maximum(a[:, 0], b[:, 0]), numpy.minimum(a[:, 1], b[:, 1]),
+                               numpy.maximum(a[:, 2], b[:, 2]), numpy.minimum(a[:, 3], b[:, 3])], axis=1)
+        return CSRPortals(mesh['adj'], portals.reshape(-1, 4))
+
+    return {box: [portal(box, neighbor) for neighbor in neighbors] for box, neighbors in mesh['adj'].items()}
+
+
+def mesh_components(mesh):
+    """
+    The connected component of every box, computed once and cached as mesh['components'].
+
+    Returns the cached dict; its 'labels' array holds each box's component id,
+    parallel to mesh['boxes']. Two boxes are connected iff their labels match.
+    After nm_meshedit.update_components only the per-box dict is current,
+    and the array is rebuilt from it. Labels that do not cover exactly the
+    mesh's boxes are recomputed.
+    """
+    components = mesh.get('components')
+    if components is not None and components.get('labels') is None and len(components['of']) == len(mesh['boxes']):
+        of = components['of']
+        components['labels'] = numpy.asarray([of[box] for box in mesh['boxes']], dtype=numpy.int32)
+    if components is None or components.get('labels') is None or len(components['labels']) != len(mesh['boxes']):
+        components = mesh['components'] = {'labels': compute_components(mesh)}
+    return components
+
+
+def compute_components(mesh):
+    """Labels every box with the index of its connected component, by flood fill over the adjacency."""
+    n = len(mesh['boxes'])
+    if 'arrays' in mesh:
+        offsets = mesh['arrays']['offsets'].tolist()
+        neighbors = mesh['arrays']['neighbors'].tolist()
+
+        def neighbors_of(i): return neighbors[offsets[i]:offsets[i + 1]]
+    else:
+        boxes = list(mesh['boxes'])
+        ids = {box: i for i, box in enumerate(boxes)}
+
+        def neighbors_of(i): return [ids[b] for b in mesh['adj'].get(boxes[i], [])]
+
+    label = [-1] * n
+    count = 0
+    for start in range(n):
+        if label[start] >= 0:
+            continue
+        label[start] = count
+        frontier = [start]
+        while frontier:
+            for j in neighbors_of(frontier.pop()):
+                if label[j] < 0:
+                    label[j] = count
+                    frontier.append(j)
+        count += 1
+    return numpy.asarray(label, dtype=numpy.int32)
+
+
+def component_lookup(mesh):
+    """A dict from box tuple to component id, built once and kept with the component labels."""
+    components = mesh.get('components')
+    of = components.get('of') if components is not None else None
+    if of is None or len(of) != len(mesh['boxes']):
+        components = mesh_components(mesh)
+        labels = components['labels'].tolist()
+        assert len(labels) == len(mesh['boxes']), "component labels do not match the mesh's boxes"
+        of = components['of'] = dict(zip(mesh['boxes'], labels))
+    return of
+
+
+def arrays_to_mesh(arrays):
+    """Wraps memory-mapped arrays in the same dict interface the pickled meshes provide."""
+    adj = CSRAdjacency(arrays['boxes'], arrays['offsets'], arrays['neighbors'])
+    return {'boxes': adj.boxes, 'adj': adj, 'arrays': arrays}
+
+
+# Optional precomputed tables stored next to a mesh file as <mesh file>.<kind>.npz
+SIDECARS = ('landmarks', 'hierarchy', 'components')
+
+
+def mesh_fingerprint(mesh, chunk_size=1 << 20):
+    """
+    (number of boxes, SHA-1 hex digest of the boxes) identifying the mesh a table was computed for.
+
+    The boxes are hashed in mesh['boxes'] order as little endian float64, so a
+    pickled mesh and the binary file converted from it share a fingerprint.
+    """
+    if 'arrays' in mesh:
+        boxes = mesh['arrays']['boxes']
+    else:
+        boxes = numpy.asarray(list(mesh['boxes']), dtype=numpy.float64).reshape(-1, 4)
+    digest = hashlib.sha1()
+    for i in range(0, len(boxes), chunk_size):
+        digest.update(numpy.ascontiguousarray(boxes[i:i + chunk_size], dtype='<f8').tobytes())
+    return len(boxes), digest.hexdigest()
+
+
+def sidecar_filename(mesh_filename, kind):
+    return '%s.%s.npz' % (mesh_filename, kind)
+
+
+def save_sidecar(arrays, mesh, mesh_filename, kind):
+    """Saves the array entries of a table computed for mesh next to the mesh file, stamped with its fingerprint."""
+    filename = sidecar_filename(mesh_filename, kind)
+    count, digest = mesh_fingerprint(mesh)
+    entries = {key: value for key, value in arrays.items() if isinstance(value, numpy.ndarray)}
+    numpy.savez(filename, box_count=numpy.int64(count), box_digest=numpy.array(digest), **entries)
+    return filename
+
+
+def remove_sidecars(mesh_filename):
+    """Deletes the tables stored next to a mesh file; called whenever the mesh file is rewritten."""
+    for kind in SIDECARS:
+        filename = sidecar_filename(mesh_filename, kind)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+
+def load_sidecars(mesh, mesh_filename):
+    """
+    Attaches every sidecar table found next to mesh_filename to the mesh, e.g. mesh['landmarks'].
+
+    Tables whose fingerprint does not match the mesh (left over from an
+    earlier build of the same file) are ignored with a warning.
+    """
+    fingerprint = None
+    for kind in SIDECARS:
+        filename = sidecar_filename(mesh_filename, kind)
+        if not os.path.exists(filename):
+            continue
+        with numpy.load(filename) as data:
+            if fingerprint is None:
+                fingerprint = mesh_fingerprint(mesh)
+            if 'box_digest' not in data.files or (int(data['box_count']), str(data['box_digest'])) != fingerprint:
+                print("Ignoring %s: it was not computed for this mesh." % filename, file=sys.stderr)
+                continue
+            mesh[kind] = {key: data[key] for key in data.files if key not in ('box_count', 'box_digest')}
+    return mesh
+
+
+def load_mesh(filename):
+    """
+    Loads a navmesh from either a binary mesh file or a legacy *.mesh.pickle, with any sidecar tables.
+
+    Pickled meshes are labeled with their connected components here; binary
+    meshes take them from a components sidecar, or label them on first use.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            f.seek(0)
+            mesh = pickle.load(f)
+            mesh_components(mesh)
+        else:
+            mesh = arrays_to_mesh(load_mesh_arrays(filename))
+    return load_sidecars(mesh, filename)
+
+
+def binary_filename(filename):
+    """Maps 'map.png.mesh.pickle' to 'map.png.mesh.bin'."""
+    if filename.endswith('.pickle'):
+        filename = filename[:-len('.pickle')]
+    return filename + '.bin'
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        print("usage: %s map.mesh.pickle [more.mesh.pickle ...]" % sys.argv[0])
+        sys.exit(-1)
+
+    for pickle_filename in sys.argv[1:]:
+        with open(pickle_filename, 'rb') as f:
+            mesh = pickle.load(f)
+        out_filename = binary_filename(pickle_filename)
+        save_mesh_arrays(mesh, out_filename)
+        remove_sidecars(out_filename)
+        save_sidecar(mesh_components(mesh), mesh, out_filename, 'components')
+        print("Converted %s -> %s (%d boxes)." % (pickle_filename, out_filename, len(mesh['boxes'])))
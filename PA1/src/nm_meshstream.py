@@ -0,0 +1,267 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy
+
+import nm_meshbuilder
+import nm_meshformat
+
+# Out-of-core mesh building for maps too large to hold in memory.
+#
+# The builder's split tree is walked as in build_mesh_tiled, down to nodes at
+# most strip_size rows tall, and each of those is read from a memory-mapped
+# .npy or raw file and scanned on its own. The cuts above them are then
+# replayed with the builder's merge step, so boxes cut at a seam are fused
+# and linked exactly as build_mesh would. Only the boxes still touching a cut
+# to come stay in memory: every box is appended to a scratch file when it is
+# made, and edges and fusions are appended as box numbers. The fusions are
+# applied to the edges once everything is scanned, and the binary mesh file is
+# assembled from the scratch files in fixed-size chunks.
+
+DEFAULT_STRIP_SIZE = 1024
+PARITY_STRIP_SIZES = (64, 100, 256, 300)
+
+
+def open_image(filename, shape=None):
+    """Memory-maps a uint8 map image: a .npy file, or a raw row-major buffer of the given (height, width)."""
+    if filename.endswith('.npy'):
+        return numpy.load(filename, mmap_mode='r')
+    return numpy.memmap(filename, dtype=numpy.uint8, mode='r', shape=shape)
+
+
+def white_counts(image, min_feature_size, strip_size):
+    """
+    The white pixel count of each node of the split tree above the strips, reading each strip once.
+
+    Nodes are split here whatever their contents (the builder would stop at
+    uniform ones), so a node's count is just the sum of its halves'.
+    """
+    # a white area of -1 leaves is_leaf only its size tests
+    order = []
+    stack = [(0, image.shape[0], 0, image.shape[1])]
+    while stack:
+        box = stack.pop()
+        order.append(box)
+        x1, x2, y1, y2 = box
+        if x2 - x1 > strip_size and not nm_meshbuilder.is_leaf(box, -1, min_feature_size):
+            stack.extend(nm_meshbuilder.split_box(box)[2:])
+
+    counts = {}
+    for box in reversed(order):
+        x1, x2, y1, y2 = box
+        if x2 - x1 > strip_size and not nm_meshbuilder.is_leaf(box, -1, min_feature_size):
+            _, _, first_box, second_box = nm_meshbuilder.split_box(box)
+            counts[box] = counts[first_box] + counts[second_box]
+        else:
+            counts[box] = int(numpy.count_nonzero(numpy.asarray(image[x1:x2, y1:y2]) == 255))
+    return counts
+
+
+def open_boxes(node, boxes, ids, shape):
+    """The {box: number} of the boxes of a split tree node that touch one of its sides inside the image."""
+    x1, x2, y1, y2 = node
+    return {b: ids[b] for b in boxes
+            if (b[0] == x1 and x1 > 0) or (b[1] == x2 and x2 < shape[0])
+            or (b[2] == y1 and y1 > 0) or (b[3] == y2 and y2 < shape[1])}
+
+
+def resolve_edges(edges, fusions, n_boxes):
+    """
+    resolve_merges on box numbers: each edge end becomes the box it was finally fused into.
+
+    edges and fusions are (a, b, stamp) and (box, fused box, stamp) rows; as
+    in the builder, a fusion made at the cut that made an edge does not apply
+    to that edge.
+    """
+    final = numpy.arange(n_boxes)
+    fused_at = numpy.full(n_boxes, -1)
+    if len(fusions):
+        final[fusions[:, 0]] = fusions[:, 1]
+        fused_at[fusions[:, 0]] = fusions[:, 2]
+        # follow fusions of fused boxes by pointer jumping
+        while True:
+            jumped = final[final]
+            if numpy.array_equal(jumped, final):
+                break
+            final = jumped
+    ends, stamps = edges[:, :2], edges[:, 2:]
+    return numpy.where(fused_at[ends] == stamps, ends, final[ends])
+
+
+def build_mesh_streaming(image, min_feature_size, out_filename, strip_size=DEFAULT_STRIP_SIZE):
+    """
+    Builds a binary mesh file from a (memory-mapped) image, strip_size rows at a time; the mesh is build_mesh's.
+
+    Returns the number of (boxes, edges) written. Working memory is bounded
+    by one strip (the pixels plus the builder's integral image), the boxes
+    along the seams still to be merged, and a few numbers per box for the
+    final renumbering, not by the size of the image.
+    """
+    height, width = image.shape[:2]
+    counts = white_counts(image, min_feature_size, strip_size)
+    scratch_filenames = {kind: '%s.%s.tmp' % (out_filename, kind)
+                         for kind in ('boxes', 'edges', 'fusions', 'resolved', 'kept', 'linked')}
+    n_boxes = 0
+
+    def write(f, rows, columns):
+        f.write(numpy.asarray(rows, dtype='<i4').reshape(-1, columns).tobytes())
+
+    try:
+        with open(scratch_filenames['boxes'], 'wb') as boxes_file, \
+                open(scratch_filenames['edges'], 'wb') as edges_file, \
+                open(scratch_filenames['fusions'], 'wb') as fusions_file:
+
+            def number(boxes, ids):
+                """Numbers the boxes not numbered yet, in order, appending them to the box file."""
+                nonlocal n_boxes
+                new = [b for b in dict.fromkeys(boxes) if b not in ids]
+                ids.update(zip(new, range(n_boxes, n_boxes + len(new))))
+                write(boxes_file, new, 4)
+                n_boxes += len(new)
+
+            # replay the split tree as build_mesh_tiled does, with a strip for each tile
+            results = []
+            cuts = 0
+            stack = [((0, height, 0, width), None)]
+            while stack:
+                box, split = stack.pop()
+
+                if split is not None:
+                    second = results.pop()
+                    first = results.pop()
+                    cuts += 1
+                    merges = {}
+                    boxes, edges = nm_meshbuilder.merge_halves(split[0], split[1], (list(first), []),
+                                                               (list(second), []), merges, cuts)
+                    ids = {**first, **second}
+                    number(boxes, ids)
+                    write(fusions_file, [(ids[b], ids[fused], stamp) for b, (fused, stamp) in merges.items()], 3)
+                    write(edges_file, [(ids[a], ids[b], stamp) for a, b, stamp in edges], 3)
+                    results.append(open_boxes(box, boxes, ids, image.shape))
+                    continue
+
+                x1, x2, y1, y2 = box
+                if x2 - x1 <= strip_size:
+                    # scan_region resolves the strip's own fusions; stamp 0 lets every seam fusion apply
+                    boxes, edges = nm_meshbuilder.scan_region(numpy.asarray(image[x1:x2, y1:y2]), min_feature_size,
+                                                              box)
+                    ids = {}
+                    number(boxes + [b for edge in edges for b in edge], ids)
+                    write(edges_file, [(ids[a], ids[b], 0) for a, b in edges], 3)
+                    results.append(open_boxes(box, boxes, ids, image.shape))
+                elif nm_meshbuilder.is_leaf(box, counts[box], min_feature_size):
+                    boxes = [box] if counts[box] == (x2 - x1) * (y2 - y1) else []
+                    ids = {}
+                    number(boxes, ids)
+                    results.append(open_boxes(box, boxes, ids, image.shape))
+                else:
+                    axis, cut, first_box, second_box = nm_meshbuilder.split_box(box)
+                    stack.append((box, (axis, cut)))
+                    stack.append((second_box, None))
+                    stack.append((first_box, None))
+
+        def scratch(kind, columns):
+            filename = scratch_filenames[kind]
+            if not os.path.getsize(filename):
+                return numpy.zeros((0, columns), dtype='<i4')
+            return numpy.memmap(filename, dtype='<i4', mode='r').reshape(-1, columns)
+
+        # apply the fusions, then keep only the boxes some edge names, renumbered in order (as build_mesh does)
+        chunk_size = 1 << 20
+        edges, fusions = scratch('edges', 3), numpy.array(scratch('fusions', 3))
+        used = numpy.zeros(n_boxes, dtype=bool)
+        with open(scratch_filenames['resolved'], 'wb') as f:
+            for i in range(0, len(edges), chunk_size):
+                resolved = resolve_edges(numpy.asarray(edges[i:i + chunk_size]), fusions, n_boxes)
+                used[resolved.ravel()] = True
+                write(f, resolved, 2)
+        renumber = numpy.cumsum(used) - 1
+        boxes = scratch('boxes', 4)
+        with open(scratch_filenames['kept'], 'wb') as f:
+            for i in range(0, n_boxes, chunk_size):
+                write(f, boxes[i:i + chunk_size][used[i:i + chunk_size]], 4)
+        resolved = scratch('resolved', 2)
+        with open(scratch_filenames['linked'], 'wb') as f:
+            for i in range(0, len(resolved), chunk_size):
+                write(f, renumber[resolved[i:i + chunk_size]], 2)
+
+        kept, linked = scratch('kept', 4), scratch('linked', 2)
+        nm_meshformat.assemble_mesh_file(out_filename, kept, linked)
+        nm_meshformat.remove_sidecars(out_filename)
+        n_boxes, n_edges = len(kept), len(linked)
+    finally:
+        for filename in scratch_filenames.values():
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    return n_boxes, n_edges
+
+
+def pixel_components(mesh, shape):
+    """A raster of the component label of the box covering each pixel, -1 where no box does."""
+    component = nm_meshformat.component_lookup(mesh)
+    labels = numpy.full(shape, -1, dtype=numpy.int64)
+    for box in mesh['boxes']:
+        x1, x2, y1, y2 = box
+        labels[x1:x2, y1:y2] = component[box]
+    return labels
+
+
+def check_parity(image, min_feature_size, strip_sizes=PARITY_STRIP_SIZES):
+    """
+    Asserts that streaming builds with each strip size cover exactly the pixels build_mesh's mesh covers,
+    and that two covered pixels are connected in one mesh exactly when they are in the other.
+    """
+    expected = pixel_components(nm_meshbuilder.build_mesh(numpy.asarray(image), min_feature_size), image.shape)
+    covered = expected >= 0
+    with tempfile.TemporaryDirectory() as directory:
+        for strip_size in strip_sizes:
+            filename = os.path.join(directory, 'strips%d.mesh.bin' % strip_size)
+            build_mesh_streaming(image, min_feature_size, filename, strip_size)
+            labels = pixel_components(nm_meshformat.load_mesh(filename), image.shape)
+            assert numpy.array_equal(labels >= 0, covered), "%d-row strips cover other pixels" % strip_size
+            # same partition: every label of one mesh pairs with exactly one label of the other
+            pairs = numpy.unique(numpy.stack([expected[covered], labels[covered]]), axis=1)
+            assert len(pairs[0]) == len(numpy.unique(pairs[0])) == len(numpy.unique(pairs[1])), \
+                "%d-row strips connect other pixels" % strip_size
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) in (3, 4) and sys.argv[1] == '--check':
+        if sys.argv[2].endswith('.npy'):
+            image = open_image(sys.argv[2])
+        else:
+            image = (nm_meshbuilder.imread(sys.argv[2]) * 255).astype(numpy.uint8)
+            if len(image.shape) > 2:
+                image = image[:, :, 0]
+        min_feature_size = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+        check_parity(image, min_feature_size)
+        print("Streaming builds with %s-row strips match build_mesh on %s."
+              % ('/'.join(map(str, PARITY_STRIP_SIZES)), sys.argv[2]))
+        sys.exit(0)
+
+    if len(sys.argv) not in (3, 4, 5):
+        print("usage: %s map.npy out.mesh.bin [min_feature_size [strip_size]]" % sys.argv[0])
+        print("       %s --check map_filename [min_feature_size]" % sys.argv[0])
+        sys.exit(-1)
+
+    image = open_image(sys.argv[1])
+    out_filename = sys.argv[2]
+    min_feature_size = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+    strip_size = int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_STRIP_SIZE
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    n_boxes, n_edges = build_mesh_streaming(image, min_feature_size, out_filename, strip_size)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("Built a mesh with %d boxes and %d edges from a %dx%d image in %.2fs."
+          % (n_boxes, n_edges, image.shape[0], image.shape[1], elapsed))
+    print("Peak traced memory %.1f MB with %d-row strips (one strip is %.1f MB)."
+          % (peak / 2**20, strip_size, strip_size * image.shape[1] / 2**20))
@@ -1,15 +1,156 @@
-from queue import PriorityQueue
+from collections import OrderedDict
+from heapq import heappop, heappush
+from itertools import count
 import math
+import multiprocessing
+import os
+
+import numpy
+
+import nm_hierarchy
+import nm_landmarks
+import nm_meshformat
+
+
+def build_box_index(mesh, cell_size=None):
+    """
+    Builds a uniform bucket grid over the mesh boxes for fast point location.
+
+    Every box is registered in each bucket it overlaps (bounds inclusive, like
+    find_box), in mesh['boxes'] order, so the first hit in a bucket is the same
+    box a linear scan would return (after nm_meshedit.replace_boxes, a point
+    on an edge two boxes share may resolve to either). Buckets are stored
+    CSR-style: the box ids of bucket b are items[offsets[b]:offsets[b + 1]].
+    """
+    boxes = mesh['arrays']['boxes'] if 'arrays' in mesh else mesh['boxes']
+    boxes = numpy.asarray(boxes, dtype=float).reshape(-1, 4)
+    if len(boxes):
+        x_lo, x_hi = boxes[:, 0].min(), boxes[:, 1].max()
+        y_lo, y_hi = boxes[:, 2].min(), boxes[:, 3].max()
+    else:
+        x_lo = x_hi = y_lo = y_hi = 0.0
+
+    if cell_size is None:
+        # aim for roughly one box per bucket on average
+        area = max((x_hi - x_lo) * (y_hi - y_lo), 1.0)
+        cell_size = max(math.sqrt(area / max(len(boxes), 1)), 1.0)
+
+    rows = int((x_hi - x_lo) // cell_size) + 1
+    cols = int((y_hi - y_lo) // cell_size) + 1
+
+    r1 = ((boxes[:, 0] - x_lo) // cell_size).astype(numpy.int64)
+    r2 = ((boxes[:, 1] - x_lo) // cell_size).astype(numpy.int64)
+    c1 = ((boxes[:, 2] - y_lo) // cell_size).astype(numpy.int64)
+    c2 = ((boxes[:, 3] - y_lo) // cell_size).astype(numpy.int64)
+
+    buckets = [[] for _ in range(rows * cols)]
+    for i in range(len(boxes)):
+        for r in range(r1[i], r2[i] + 1):
+            for c in range(c1[i], c2[i] + 1):
+                buckets[r * cols + c].append(i)
+
+    offsets = numpy.zeros(rows * cols + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(b) for b in buckets])
+    items = numpy.fromiter((i for b in buckets for i in b), dtype=numpy.int64, count=offsets[-1])
+
+    return {'source': mesh['boxes'], 'count': len(boxes), 'array': boxes, 'origin': (x_lo, y_lo),
+            'cell_size': cell_size, 'shape': (rows, cols), 'buckets': buckets, 'offsets': offsets, 'items': items}
+
+
+def box_index(mesh):
+    """Returns the mesh's spatial index, (re)building it if missing or stale."""
+    index = mesh.get('box_index')
+    if index is None or index['source'] is not mesh['boxes'] or index['count'] != len(mesh['boxes']):
+        index = build_box_index(mesh)
+        mesh['box_index'] = index
+    return index
+
+
+def _packed_index(index):
+    """The index with its box array and CSR buckets repacked after nm_meshedit.replace_boxes, if need be."""
+    if index['items'] is None:
+        buckets = index['buckets']
+        index['array'] = numpy.asarray(index['source'], dtype=float).reshape(-1, 4)
+        index['offsets'] = offsets = numpy.zeros(len(buckets) + 1, dtype=numpy.int64)
+        offsets[1:] = numpy.cumsum([len(b) for b in buckets])
+        index['items'] = numpy.fromiter((i for b in buckets for i in b), dtype=numpy.int64, count=offsets[-1])
+    return index
+
 
 def find_box(point, mesh):
     """Find the box that contains the given point."""
+    index = box_index(mesh)
     x, y = point
-    for box in mesh['boxes']:
-        x1, x2, y1, y2 = box
+    x_lo, y_lo = index['origin']
+    rows, cols = index['shape']
+    r = int((x - x_lo) // index['cell_size'])
+    c = int((y - y_lo) // index['cell_size'])
+    if not (0 <= r < rows and 0 <= c < cols):
+        return None
+
+    boxes = mesh['boxes']
+    for i in index['buckets'][r * cols + c]:
+        x1, x2, y1, y2 = boxes[i]
         if x1 <= x <= x2 and y1 <= y <= y2:
-            return box
+            return boxes[i]
     return None
 
+
+def find_boxes(points, mesh):
+    """
+    Vectorized find_box: locates every point of an (N, 2) array-like at once.
+
+    Returns an int array of indices into mesh['boxes'], with -1 for points that
+    lie outside the navigable area.
+    """
+    index = _packed_index(box_index(mesh))
+    points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+    result = numpy.full(len(points), -1, dtype=numpy.int64)
+    if not len(points):
+        return result
+
+    x_lo, y_lo = index['origin']
+    rows, cols = index['shape']
+    r = numpy.floor((points[:, 0] - x_lo) / index['cell_size']).astype(numpy.int64)
+    c = numpy.floor((points[:, 1] - y_lo) / index['cell_size']).astype(numpy.int64)
+    inside = (r >= 0) & (r < rows) & (c >= 0) & (c < cols)
+
+    query = numpy.nonzero(inside)[0]
+    bucket = r[query] * cols + c[query]
+    starts = index['offsets'][bucket]
+    counts = index['offsets'][bucket + 1] - starts
+
+    # expand every (point, candidate box) pair and test them all in one go
+    pair_query = numpy.repeat(query, counts)
+    first = numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    pair_box = index['items'][numpy.repeat(starts, counts) + numpy.arange(counts.sum()) - first]
+
+    px, py = points[pair_query, 0], points[pair_query, 1]
+    b = index['array'][pair_box]
+    hit = (b[:, 0] <= px) & (px <= b[:, 1]) & (b[:, 2] <= py) & (py <= b[:, 3])
+
+    # candidates are in mesh order within a bucket, so keep the first hit per point
+    hit_query, hit_box = pair_query[hit], pair_box[hit]
+    keep = numpy.ones(len(hit_query), dtype=bool)
+    keep[1:] = hit_query[1:] != hit_query[:-1]
+    result[hit_query[keep]] = hit_box[keep]
+    return result
+
+
+def reachable(pairs, mesh):
+    """
+    Vectorized reachability filter for (source_point, destination_point) pairs.
+
+    Returns a bool array that is True where both points lie in the mesh, in
+    the same connected component, i.e. exactly where find_path can succeed.
+    """
+    points = numpy.asarray(pairs, dtype=float).reshape(-1, 2, 2)
+    source = find_boxes(points[:, 0], mesh)
+    destination = find_boxes(points[:, 1], mesh)
+    labels = nm_meshformat.mesh_components(mesh)['labels']
+    return (source >= 0) & (destination >= 0) & (labels[source] == labels[destination])
+
+
 def euclidean_distance(point1, point2):
     """Calculate the Euclidean distance between two points."""
     return math.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2)
@@ -28,23 +169,386 @@ def reconstruct_path(forward_prev, backward_prev, meeting_box, forward_points, b
 
     # Forward path: from source to meeting box
     current_box = meeting_box
-    while current_box:
+    while current_box is not None:
         path.append(forward_points[current_box])
         current_box = forward_prev[current_box]
     path.reverse()
 
     # Backward path: from meeting box to destination
     current_box = meeting_box
-    while current_box:
+    while current_box is not None:
         path.append(backward_points[current_box])
         current_box = backward_prev[current_box]
     path.append(destination_point)
 
     return path
 
-def find_path(source_point, destination_point, mesh):
+def reconstruct_corridor(forward_prev, backward_prev, meeting_box):
+    """The sequence of boxes from the source box through meeting_box to the destination box."""
+    corridor = []
+    current_box = meeting_box
+    while current_box is not None:
+        corridor.append(current_box)
+        current_box = forward_prev[current_box]
+    corridor.reverse()
+
+    current_box = backward_prev[meeting_box]
+    while current_box is not None:
+        corridor.append(current_box)
+        current_box = backward_prev[current_box]
+
+    return corridor
+
+def _triarea2(a, b, c):
+    """Twice the signed area of triangle abc."""
+    return (c[0] - a[0]) * (b[1] - a[1]) - (b[0] - a[0]) * (c[1] - a[1])
+
+def corridor_portals(corridor, mesh):
+    """
+    The (left, right) endpoints of each portal crossed along a box corridor.
+
+    Endpoints are labelled relative to the direction of travel from one box's
+    centre to the next, which is what the funnel algorithm expects.
+    """
+    adj, portals = mesh['adj'], nm_meshformat.mesh_portals(mesh)
+    result = []
+    for a, b in zip(corridor, corridor[1:]):
+        x1, x2, y1, y2 = portals[a][adj[a].index(b)]
+        p, q = (x1, y1), (x2, y2)
+        a_centre = ((a[0] + a[1]) / 2, (a[2] + a[3]) / 2)
+        b_centre = ((b[0] + b[1]) / 2, (b[2] + b[3]) / 2)
+        if _triarea2(a_centre, b_centre, p) > _triarea2(a_centre, b_centre, q):
+            p, q = q, p
+        result.append((p, q))
+    return result
+
+def string_pull(portals, source_point, destination_point):
+    """
+    Shortest path through a sequence of (left, right) portals ("simple stupid funnel algorithm").
+
+    The funnel is anchored at the current apex and narrowed portal by portal;
+    when one side crosses over the other, the crossed endpoint becomes a
+    waypoint and the new apex, and the scan restarts from there.
+    """
+    portals = [(source_point, source_point)] + list(portals) + [(destination_point, destination_point)]
+    path = [source_point]
+    apex = left = right = source_point
+    apex_index = left_index = right_index = 0
+
+    i = 1
+    while i < len(portals):
+        new_left, new_right = portals[i]
+
+        # try to narrow the funnel on the right
+        if _triarea2(apex, right, new_right) <= 0:
+            if apex == right or _triarea2(apex, left, new_right) > 0:
+                right, right_index = new_right, i
+            else:
+                # right crossed over left: left becomes a corner of the path
+                path.append(left)
+                apex, apex_index = left, left_index
+                left = right = apex
+                left_index = right_index = apex_index
+                i = apex_index + 1
+                continue
+
+        # try to narrow the funnel on the left
+        if _triarea2(apex, left, new_left) >= 0:
+            if apex == left or _triarea2(apex, right, new_left) < 0:
+                left, left_index = new_left, i
+            else:
+                path.append(right)
+                apex, apex_index = right, right_index
+                left = right = apex
+                left_index = right_index = apex_index
+                i = apex_index + 1
+                continue
+
+        i += 1
+
+    if path[-1] != destination_point:
+        path.append(destination_point)
+    return path
+
+def corridor_path(corridor, source_point, destination_point, mesh, meeting=None):
+    """
+    Walks a known box corridor with the search's step rule: enter each box at the nearest portal point.
+
+    Given the index of the box where bidirectional_search met, the boxes past
+    it are walked back from destination_point instead, which reproduces the
+    path that search returned exactly.
+    """
+    adj, portals = mesh['adj'], nm_meshformat.mesh_portals(mesh)
+    if meeting is None:
+        meeting = len(corridor) - 1
+        tail = []
+    else:
+        tail = [destination_point]
+        back = corridor[:meeting - 1 if meeting else None:-1]
+        for a, b in zip(back, back[1:]):
+            tail.append(closest_point(tail[-1], portals[a][adj[a].index(b)]))
+        tail.reverse()
+    path = [source_point]
+    for a, b in zip(corridor[:meeting], corridor[1:meeting + 1]):
+        path.append(closest_point(path[-1], portals[a][adj[a].index(b)]))
+    path.extend(tail)
+    path.append(destination_point)
+    return path
+
+class BoxBoundedCache:
+    """
+    LRU bookkeeping shared by the caches of per-mesh search results.
+
+    The bound is on the total number of boxes held across all entries, as
+    counted by cost(value), which tracks memory use better than an entry
+    count. The cache empties itself when it is used with a
+    different mesh, or after that mesh's boxes, adjacency or 'version'
+    entry have been replaced.
+    """
+
+    def __init__(self, max_boxes, cost):
+        self.max_boxes = max_boxes
+        self.cost = cost
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.mesh_key = None
+
+    def _check_mesh(self, mesh):
+        # the key holds the objects themselves (dicts cannot be weakly referenced): comparing ids
+        # would let a new mesh allocated at a collected one's address pass for it
+        key = (mesh, mesh['boxes'], mesh['adj'], mesh.get('version'))
+        old = self.mesh_key
+        if old is None or any(a is not b for a, b in zip(key[:3], old[:3])) or key[3] != old[3]:
+            self.clear()
+            self.mesh_key = key
+
+    def _lookup(self, key):
+        """The entry for key, marked most recently used, or None on a miss."""
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _store(self, key, value):
+        """Adds or replaces an entry, evicting the least recently used ones to stay within max_boxes."""
+        if key in self.entries:
+            self.size -= self.cost(self.entries.pop(key))
+        cost = self.cost(value)
+        if cost > self.max_boxes:
+            return
+        self.entries[key] = value
+        self.size += cost
+        while self.size > self.max_boxes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= self.cost(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'boxes': self.size}
+
+class PathCache(BoxBoundedCache):
+    """
+    Bounded LRU cache of box corridors keyed by (source box, destination box).
+
+    Each entry is a (corridor, meeting) pair, meeting being the corridor index
+    where the two sides of the search met. A hit skips the search entirely:
+    only the walk through the cached corridor is redone for the exact
+    endpoints. An unreachable pair costs one box.
+    """
+
+    def __init__(self, max_boxes=100000):
+        super().__init__(max_boxes, lambda entry: max(len(entry[0]), 1))
+
+    def get(self, source_box, destination_box, mesh):
+        """The cached (corridor, meeting) pair (([], None) if known unreachable), or None on a miss."""
+        self._check_mesh(mesh)
+        return self._lookup((source_box, destination_box))
+
+    def put(self, source_box, destination_box, corridor, meeting, mesh):
+        self._check_mesh(mesh)
+        self._store((source_box, destination_box), (corridor, meeting))
+
+def _frontier(start_box, start_point, heuristic):
+    """Per-direction search state for bidirectional_search."""
+    return {'dist': {start_box: 0}, 'prev': {start_box: None}, 'points': {start_box: start_point},
+            'closed': set(), 'heap': [(heuristic(start_box, start_point), 0, 0, start_box)],
+            'heuristic': heuristic}
+
+def _prune(side):
+    """Drop stale heap entries (closed boxes or superseded distances) from the top of a frontier."""
+    heap, dist, closed = side['heap'], side['dist'], side['closed']
+    while heap and (heap[0][3] in closed or heap[0][2] != dist[heap[0][3]]):
+        heappop(heap)
+
+def bidirectional_search(source_box, destination_box, source_point, destination_point, adj, portals,
+                         heuristics=None, allowed=None, cancel=None, consistent=True):
+    """
+    Bidirectional A* between two distinct boxes, returning (path, visited, corridor, meeting).
+
+    heuristics is an optional (forward, backward) pair of admissible
+    (box, point) -> estimate functions toward the destination and source
+    respectively; straight-line distance is used by default. Heuristics that
+    are admissible but not consistent (the landmark bounds change per box, not
+    per point) need consistent=False: a closed box is then reopened when a
+    shorter route to it turns up, instead of being skipped. If allowed is
+    given, the search never enters boxes outside it. meeting is the index in
+    corridor of the box where the two sides met. path and corridor are empty
+    (and meeting None) when no route exists, or when cancel (a
+    threading.Event, checked before each expansion) is set from another
+    thread.
+
+    Each direction keeps its own heapq of (f, tie, g, box) entries. Nothing is
+    removed on decrease-key; instead an entry is skipped when popped if its box
+    is already closed or a shorter distance has been recorded since it was
+    pushed. Whenever one side reaches a box the other side has reached too, the
+    joined cost becomes a meeting candidate.
+
+    The two sides share balanced potentials: the forward side orders boxes by
+    g + (h_forward - h_backward) / 2 and the backward side by the negation of
+    that potential. Because the potentials cancel, the search may stop as soon
+    as the two best f values together can no longer beat the best candidate,
+    which on these meshes expands fewer boxes than stopping when either one
+    alone reaches it (the usual front-to-end test).
+
+    Moving into a neighbor enters it at the point of the shared portal that is
+    closest to the current point.
+    """
+    if heuristics is None:
+        heuristics = (lambda box, point: euclidean_distance(point, destination_point),
+                      lambda box, point: euclidean_distance(point, source_point))
+    to_destination, to_source = heuristics
+
+    def forward_potential(box, point):
+        return (to_destination(box, point) - to_source(box, point)) / 2
+
+    def backward_potential(box, point):
+        return (to_source(box, point) - to_destination(box, point)) / 2
+
+    forward = _frontier(source_box, source_point, forward_potential)
+    backward = _frontier(destination_box, destination_point, backward_potential)
+    tie = count(1)
+    best_cost, meeting_box = math.inf, None
+
+    while True:
+        _prune(forward)
+        _prune(backward)
+        if not forward['heap'] or not backward['heap']:
+            break
+        if forward['heap'][0][0] + backward['heap'][0][0] >= best_cost:
+            break
+        if cancel is not None and cancel.is_set():
+            return [], list(forward['closed'] | backward['closed']), [], None
+
+        # grow the side with fewer open boxes to keep the two searches balanced (the heaps'
+        # lengths would also count the stale entries left behind by decrease-key)
+        if len(forward['dist']) - len(forward['closed']) <= len(backward['dist']) - len(backward['closed']):
+            side, other = forward, backward
+        else:
+            side, other = backward, forward
+
+        _, _, distance, current_box = heappop(side['heap'])
+        side['closed'].add(current_box)
+        current_point = side['points'][current_box]
+
+        for neighbor_box, portal in zip(adj.get(current_box, []), portals.get(current_box, [])):
+            if (consistent and neighbor_box in side['closed']) or (allowed is not None and neighbor_box not in allowed):
+                continue
+            neighbor_point = closest_point(current_point, portal)
+            new_distance = distance + euclidean_distance(current_point, neighbor_point)
+
+            if new_distance < side['dist'].get(neighbor_box, math.inf):
+                side['closed'].discard(neighbor_box)
+                side['dist'][neighbor_box] = new_distance
+                side['prev'][neighbor_box] = current_box
+                side['points'][neighbor_box] = neighbor_point
+                heuristic = side['heuristic'](neighbor_box, neighbor_point)
+                heappush(side['heap'], (new_distance + heuristic, next(tie), new_distance, neighbor_box))
+
+                if neighbor_box in other['dist']:
+                    joined = (new_distance + other['dist'][neighbor_box]
+                              + euclidean_distance(neighbor_point, other['points'][neighbor_box]))
+                    if joined < best_cost:
+                        best_cost, meeting_box = joined, neighbor_box
+
+    visited = list(forward['closed'] | backward['closed'])
+    if meeting_box is None:
+        return [], visited, [], None
+
+    path = reconstruct_path(forward['prev'], backward['prev'], meeting_box,
+                            forward['points'], backward['points'], destination_point)
+    corridor = reconstruct_corridor(forward['prev'], backward['prev'], meeting_box)
+    return path, visited, corridor, corridor.index(meeting_box)
+
+def step_rule_search(mesh, start_box, start_point, allowed=None):
+    """
+    Single-source Dijkstra from start_point (inside start_box) with the pathfinder's step rule.
+
+    Each box is entered at the point of the shared portal closest to the
+    point the route entered the previous box at, so every label is the
+    length of a walk find_path could take; as the rule is symmetric, the
+    same labels describe routes toward start_point. With a set of allowed
+    boxes the search never leaves them.
+
+    Returns (dist, points, prev) keyed by each reached box: the distance
+    to its entry point, the entry point, and the box it is entered from
+    (None for start_box).
+    """
+    adj, portals = mesh['adj'], nm_meshformat.mesh_portals(mesh)
+    dist, points, prev = {start_box: 0}, {start_box: start_point}, {start_box: None}
+    closed = set()
+    queue = [(0, 0, start_box)]
+    tie = 1
+    while queue:
+        d, _, box = heappop(queue)
+        if box in closed:
+            continue
+        closed.add(box)
+        x, y = points[box]
+        for neighbor, (x1, x2, y1, y2) in zip(adj.get(box, []), portals.get(box, [])):
+            if neighbor in closed or (allowed is not None and neighbor not in allowed):
+                continue
+            point = min(max(x, x1), x2), min(max(y, y1), y2)
+            nd = d + math.dist((x, y), point)
+            if nd < dist.get(neighbor, math.inf):
+                dist[neighbor] = nd
+                points[neighbor] = point
+                prev[neighbor] = box
+                heappush(queue, (nd, tie, neighbor))
+                tie += 1
+    return dist, points, prev
+
+def find_path(source_point, destination_point, mesh, smooth=False, landmarks=False, hierarchical=False, cache=None,
+              cancel=None):
     """
     Searches for a path from source_point to destination_point through the mesh.
+
+    With smooth=True the box corridor found by the search is string-pulled
+    into the shortest path through its portals, which drops the zig-zag
+    waypoints at box corners. With landmarks=True, landmark tables carried
+    by the mesh (see nm_landmarks) tighten the search heuristic. This is
+    opt-in: on the sample maps the tables only save a few percent of the
+    expansions, which does not pay for evaluating them on every push.
+
+    hierarchical=True first plans over the region abstraction (see
+    nm_hierarchy, built on first use if the mesh has none) and then only
+    searches the boxes of the regions on that plan. This trades a little path
+    quality for much less work on long queries.
+
+    With a PathCache, a repeated (source box, destination box) pair reuses the
+    cached corridor and returns the same path a search would; visited is then
+    just that corridor.
+
+    A search running in a background thread can be abandoned by setting
+    cancel (a threading.Event); it then returns no path and what it had
+    visited so far, without printing or caching anything.
     """
     source_box = find_box(source_point, mesh)
     destination_box = find_box(destination_point, mesh)
@@ -56,57 +560,135 @@ def find_path(source_point, destination_point, mesh):
     if source_box == destination_box:
         return [source_point, destination_point], [source_box]
 
-    # Initialization
-    forward_prev, backward_prev = {source_box: None}, {destination_box: None}
-    forward_points, backward_points = {source_box: source_point}, {destination_box: destination_point}
-    forward_distances, backward_distances = {source_box: 0}, {destination_box: 0}
+    # boxes in different connected components can be rejected without searching
+    component = nm_meshformat.component_lookup(mesh)
+    if component[source_box] != component[destination_box]:
+        print("No path found!")
+        return [], []
 
-    visited_forward, visited_backward = set(), set()
-    priority_queue = PriorityQueue()
-    priority_queue.put((0, source_box, "forward"))
-    priority_queue.put((0, destination_box, "backward"))
+    if cache is not None:
+        entry = cache.get(source_box, destination_box, mesh)
+        if entry is not None:
+            corridor, meeting = entry
+            if not corridor:
+                print("No path found!")
+                return [], []
+            if smooth:
+                return string_pull(corridor_portals(corridor, mesh), source_point, destination_point), list(corridor)
+            return corridor_path(corridor, source_point, destination_point, mesh, meeting), list(corridor)
 
-    # Search loop
-    while not priority_queue.empty():
-        current_distance, current_box, direction = priority_queue.get()
+    heuristics, consistent = None, True
+    if landmarks and 'landmarks' in mesh:
+        consistent = False
+        heuristics = (nm_landmarks.landmark_heuristic(mesh, destination_box, destination_point),
+                      nm_landmarks.landmark_heuristic(mesh, source_box, source_point))
 
-        if direction == "forward":
-            visited_forward.add(current_box)
-        else:
-            visited_backward.add(current_box)
-
-        # Check for meeting point
-        if current_box in visited_forward and current_box in visited_backward:
-            path = reconstruct_path(forward_prev, backward_prev, current_box, forward_points, backward_points, destination_point)
-            return path, list(visited_forward | visited_backward)
-
-        # Expand neighbors
-        for neighbor_box in mesh['adj'].get(current_box, []):
-            if direction == "forward":
-                if neighbor_box in visited_forward:
-                    continue
-                neighbor_point = closest_point(forward_points[current_box], neighbor_box)
-                new_distance = forward_distances[current_box] + euclidean_distance(forward_points[current_box], neighbor_point)
-
-                if neighbor_box not in forward_distances or new_distance < forward_distances[neighbor_box]:
-                    forward_distances[neighbor_box] = new_distance
-                    forward_prev[neighbor_box] = current_box
-                    forward_points[neighbor_box] = neighbor_point
-                    heuristic = euclidean_distance(neighbor_point, destination_point)
-                    priority_queue.put((new_distance + heuristic, neighbor_box, "forward"))
-
-            elif direction == "backward":
-                if neighbor_box in visited_backward:
-                    continue
-                neighbor_point = closest_point(backward_points[current_box], neighbor_box)
-                new_distance = backward_distances[current_box] + euclidean_distance(backward_points[current_box], neighbor_point)
-
-                if neighbor_box not in backward_distances or new_distance < backward_distances[neighbor_box]:
-                    backward_distances[neighbor_box] = new_distance
-                    backward_prev[neighbor_box] = current_box
-                    backward_points[neighbor_box] = neighbor_point
-                    heuristic = euclidean_distance(neighbor_point, source_point)
-                    priority_queue.put((new_distance + heuristic, neighbor_box, "backward"))
-
-    print("No path found!")
-    return [], list(visited_forward | visited_backward)
+    adj, portals = mesh['adj'], nm_meshformat.mesh_portals(mesh)
+    path = []
+    if hierarchical:
+        if 'hierarchy' not in mesh:
+            mesh['hierarchy'] = nm_hierarchy.build_hierarchy(mesh)
+        allowed = nm_hierarchy.abstract_corridor(source_point, destination_point, source_box, destination_box, mesh)
+        if allowed is None:
+            print("No path found!")
+            return [], []
+        path, visited, corridor, meeting = bidirectional_search(source_box, destination_box, source_point,
+                                                                destination_point, adj, portals, heuristics, allowed,
+                                                                cancel, consistent)
+
+    if not path:
+        path, visited, corridor, meeting = bidirectional_search(source_box, destination_box, source_point,
+                                                                destination_point, adj, portals, heuristics, None,
+                                                                cancel, consistent)
+    if cancel is not None and cancel.is_set():
+        return [], visited
+    if cache is not None:
+        cache.put(source_box, destination_box, corridor, meeting, mesh)
+
+    if not path:
+        print("No path found!")
+    elif smooth:
+        path = string_pull(corridor_portals(corridor, mesh), source_point, destination_point)
+    return path, visited
+
+
+_worker_mesh = None
+
+def _init_worker(mesh):
+    """Pool initializer: each worker receives the mesh once and keeps it for every task."""
+    global _worker_mesh
+    _worker_mesh = mesh
+
+def _find_path_task(task):
+    i, source_point, destination_point, smooth = task
+    return i, find_path(source_point, destination_point, _worker_mesh, smooth)
+
+class PathPool:
+    """
+    A process pool bound to one mesh, for answering many path queries per tick.
+
+    The mesh is handed to each worker once when the pool starts (inherited
+    without pickling where processes are forked), so queries only ship their
+    endpoints and results. Use as a context manager, or call close().
+    """
+
+    def __init__(self, mesh, workers=None):
+        self.mesh = mesh
+        self.workers = workers or os.cpu_count() or 1
+        # build the lazily cached structures once here rather than in every worker
+        box_index(mesh)
+        nm_meshformat.mesh_portals(mesh)
+        nm_meshformat.component_lookup(mesh)
+        self.pool = None
+        if self.workers > 1:
+            self.pool = multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(mesh,))
+
+    def imap(self, pairs, smooth=False):
+        """
+        Yields (i, (path, visited)) for pairs[i] as each query completes, in completion order.
+
+        Pairs that reachable() rules out are answered with ([], []) up front
+        and never reach the workers.
+        """
+        ok = reachable(pairs, self.mesh).tolist() if len(pairs) else []
+        for i, possible in enumerate(ok):
+            if not possible:
+                yield i, ([], [])
+        tasks = [(i, s, d, smooth) for i, (s, d) in enumerate(pairs) if ok[i]]
+        if self.pool is None:
+            for i, s, d, smooth in tasks:
+                yield i, find_path(s, d, self.mesh, smooth)
+            return
+        chunksize = max(1, len(tasks) // (self.workers * 8))
+        yield from self.pool.imap_unordered(_find_path_task, tasks, chunksize)
+
+    def find_paths(self, pairs, smooth=False):
+        """Solves every (source_point, destination_point) pair, returning (path, visited) results in input order."""
+        pairs = list(pairs)
+        results = [None] * len(pairs)
+        for i, result in self.imap(pairs, smooth):
+            results[i] = result
+        return results
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def find_paths(pairs, mesh, workers=None, smooth=False):
+    """
+    Batch find_path over a list of (source_point, destination_point) pairs.
+
+    Returns the (path, visited) results in the same order as pairs. Keep a
+    PathPool around instead when querying the same mesh repeatedly, so the
+    workers are not restarted for every batch.
+    """
+    with PathPool(mesh, workers) as pool:
+        return pool.find_paths(pairs, smooth)
@@ -0,0 +1,244 @@
+from heapq import heappop, heappush
+from itertools import count
+import math
+import random
+import sys
+import time
+
+import nm_meshformat
+import nm_pathfinder
+
+# Incremental replanning (D* Lite) over the box graph.
+#
+# The search runs backward from the destination box and keeps its g/rhs
+# labels between queries. Blocking a box, unblocking it or changing the cost
+# of an edge only puts the boxes at the ends of the changed edges back on the
+# queue, and the next query repairs labels outward from there until the
+# agent's box is consistent again, instead of searching from scratch. Moving
+# the agent along its route is handled by the usual key modifier km, so the
+# queue never has to be rebuilt.
+#
+# D* Lite needs fixed edge costs, which the pathfinder's step rule (enter at
+# the portal point nearest the current point) does not have. Edges here cost
+# the walk from one box's centre through the middle of the shared portal to
+# the other's centre; the box corridor found is then walked with the step
+# rule, or string-pulled, exactly like a find_path corridor.
+
+
+def _centre(box):
+    return (box[0] + box[1]) / 2, (box[2] + box[3]) / 2
+
+
+class Replanner:
+    """
+    A route from an agent to one destination, kept up to date as boxes are blocked and unblocked.
+
+    Changes are batched: block(), unblock() and set_cost() only record
+    what changed, and the repair happens in the next path() call.
+    """
+
+    def __init__(self, mesh, source_point, destination_point):
+        self.mesh = mesh
+        self.adj = mesh['adj']
+        self.portals = nm_meshformat.mesh_portals(mesh)
+        self.source_point = source_point
+        self.destination_point = destination_point
+        self.start = nm_pathfinder.find_box(source_point, mesh)
+        self.goal = nm_pathfinder.find_box(destination_point, mesh)
+        self.origin = _centre(self.start) if self.start else None
+        self.blocked = set()
+        self.costs = {}
+        self.changed = set()
+        self.km = 0
+        self.g = {}
+        self.rhs = {}
+        self.keys = {}
+        self.queue = []
+        self.tie = count()
+        self.expanded = 0
+        if self.goal:
+            self.rhs[self.goal] = 0
+            self._push(self.goal)
+
+    def _h(self, box):
+        """Straight-line distance between box centres; every edge costs at least that, so it stays consistent."""
+        x1, x2, y1, y2 = box
+        return math.hypot(self.origin[0] - (x1 + x2) / 2, self.origin[1] - (y1 + y2) / 2)
+
+    def cost(self, a, b):
+        """The cost of stepping between neighboring boxes a and b (infinite if either is blocked)."""
+        if a in self.blocked or b in self.blocked:
+            return math.inf
+        key = (a, b) if a < b else (b, a)
+        cost = self.costs.get(key)
+        if cost is None:
+            x1, x2, y1, y2 = self.portals[a][self.adj[a].index(b)]
+            middle = ((x1 + x2) / 2, (y1 + y2) / 2)
+            cost = (nm_pathfinder.euclidean_distance(_centre(a), middle)
+                    + nm_pathfinder.euclidean_distance(middle, _centre(b)))
+            self.costs[key] = cost
+        return cost
+
+    def _key(self, box):
+        best = min(self.g.get(box, math.inf), self.rhs.get(box, math.inf))
+        return best + self._h(box) + self.km, best
+
+    def _push(self, box):
+        key = self._key(box)
+        self.keys[box] = key
+        heappush(self.queue, (key, next(self.tie), box))
+
+    def _top_key(self):
+        """The smallest live key on the queue, dropping entries superseded or removed since they were pushed."""
+        queue, keys = self.queue, self.keys
+        while queue and keys.get(queue[0][2]) != queue[0][0]:
+            heappop(queue)
+        return queue[0][0] if queue else (math.inf, math.inf)
+
+    def _update(self, box):
+        if box != self.goal:
+            self.rhs[box] = min((self.cost(box, n) + self.g.get(n, math.inf) for n in self.adj.get(box, [])),
+                                default=math.inf)
+        self.keys.pop(box, None)
+        if self.g.get(box, math.inf) != self.rhs.get(box, math.inf):
+            self._push(box)
+
+    def _compute(self):
+        g, rhs = self.g, self.rhs
+        while (self._top_key() < self._key(self.start)
+               or rhs.get(self.start, math.inf) != g.get(self.start, math.inf)):
+            old_key, _, box = heappop(self.queue)
+            del self.keys[box]
+            self.expanded += 1
+            new_key = self._key(box)
+            if old_key < new_key:
+                self._push(box)
+            elif g.get(box, math.inf) > rhs[box]:
+                g[box] = rhs[box]
+                for neighbor in self.adj.get(box, []):
+                    self._update(neighbor)
+            else:
+                g[box] = math.inf
+                self._update(box)
+                for neighbor in self.adj.get(box, []):
+                    self._update(neighbor)
+
+    def block(self, boxes):
+        """Marks boxes as impassable."""
+        for box in boxes:
+            if box not in self.blocked:
+                self.blocked.add(box)
+                self.changed.add(box)
+                self.changed.update(self.adj.get(box, []))
+
+    def unblock(self, boxes):
+        """Makes previously blocked boxes passable again."""
+        for box in boxes:
+            if box in self.blocked:
+                self.blocked.remove(box)
+                self.changed.add(box)
+                self.changed.update(self.adj.get(box, []))
+
+    def set_cost(self, a, b, cost=None):
+        """Overrides the cost of the edge between neighboring boxes a and b; None restores the default."""
+        key = (a, b) if a < b else (b, a)
+        if cost is None:
+            self.costs.pop(key, None)
+        else:
+            self.costs[key] = cost
+        self.changed.update(key)
+
+    def move_to(self, source_point):
+        """Moves the agent; labels stay valid, only the heuristic's origin changes."""
+        box = nm_pathfinder.find_box(source_point, self.mesh)
+        if box and self.start and box != self.start:
+            self.km += nm_pathfinder.euclidean_distance(_centre(self.start), _centre(box))
+        self.start = box
+        self.origin = _centre(box) if box else None
+        self.source_point = source_point
+
+    def corridor(self):
+        """Repairs the labels after any changes and returns the box corridor to the destination ([] if none)."""
+        if not self.start or not self.goal or self.start in self.blocked or self.goal in self.blocked:
+            return []
+        for box in self.changed:
+            self._update(box)
+        self.changed.clear()
+        self._compute()
+
+        if self.g.get(self.start, math.inf) == math.inf:
+            return []
+        corridor = [self.start]
+        while corridor[-1] != self.goal:
+            box = corridor[-1]
+            corridor.append(min(self.adj[box], key=lambda n: self.cost(box, n) + self.g.get(n, math.inf)))
+        return corridor
+
+    def path(self, smooth=False):
+        """The current (path, corridor) from the agent to the destination, both empty if it is cut off."""
+        corridor = self.corridor()
+        if not corridor:
+            return [], []
+        if smooth:
+            portals = nm_pathfinder.corridor_portals(corridor, self.mesh)
+            return nm_pathfinder.string_pull(portals, self.source_point, self.destination_point), corridor
+        return nm_pathfinder.corridor_path(corridor, self.source_point, self.destination_point, self.mesh), corridor
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in (2, 3):
+        print("usage: %s map.mesh.(pickle|bin) [agents]" % sys.argv[0])
+        sys.exit(-1)
+
+    mesh = nm_meshformat.load_mesh(sys.argv[1])
+    agents = int(sys.argv[2]) if len(sys.argv) == 3 else 50
+    nm_pathfinder.box_index(mesh)
+    component = nm_meshformat.component_lookup(mesh)
+
+    # each agent walks its route box by box; now and then the box two steps
+    # ahead turns out to be blocked and the route has to be replanned
+    rng = random.Random(0)
+    boxes = list(mesh['boxes'])
+    times = {'repair': 0.0, 'scratch': 0.0, 'search': 0.0}
+    expanded = {'repair': 0, 'scratch': 0}
+    replans = 0
+    for _ in range(agents):
+        source_box, destination_box = rng.sample(boxes, 2)
+        if component[source_box] != component[destination_box]:
+            continue
+        planner = Replanner(mesh, _centre(source_box), _centre(destination_box))
+        corridor = planner.corridor()
+        allowed = set(boxes)
+        while len(corridor) > 3:
+            planner.move_to(_centre(corridor[1]))
+            if rng.random() < .3:
+                planner.block([corridor[3]])
+                allowed.discard(corridor[3])
+
+                planner.expanded = 0
+                start = time.perf_counter()
+                corridor = planner.corridor()
+                times['repair'] += time.perf_counter() - start
+                expanded['repair'] += planner.expanded
+
+                fresh = Replanner(mesh, planner.source_point, planner.destination_point)
+                fresh.block(planner.blocked)
+                start = time.perf_counter()
+                fresh.corridor()
+                times['scratch'] += time.perf_counter() - start
+                expanded['scratch'] += fresh.expanded
+
+                start = time.perf_counter()
+                nm_pathfinder.bidirectional_search(planner.start, planner.goal, planner.source_point,
+                                                   planner.destination_point, mesh['adj'], planner.portals,
+                                                   allowed=allowed)
+                times['search'] += time.perf_counter() - start
+                replans += 1
+            else:
+                corridor = corridor[1:]
+
+    print("%d replans after a box two steps ahead of the agent was blocked:" % replans)
+    print("  D* Lite repair:          %.4fs (%d expansions)" % (times['repair'], expanded['repair']))
+    print("  D* Lite from scratch:    %.4fs (%d expansions)" % (times['scratch'], expanded['scratch']))
+    print("  bidirectional_search:    %.4fs" % times['search'])
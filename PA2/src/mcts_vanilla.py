@@ -1,5 +1,5 @@
 from mcts_node import MCTSNode
-from p2_t3 import Board
+from p2_t3 import Board, MutableBoard
 from random import choice
 from math import sqrt, log
 
@@ -83,10 +83,10 @@ def rollout(board: Board, state):
 
     """
     # chooses random action until board ends in a win or loss
-    while board.is_ended(state) == False:
-        action = choice(board.legal_actions(state))
-        state = board.next_state(state, action)
-    return state
+    position = MutableBoard(state, board)
+    while not position.is_ended():
+        position.push(choice(position.legal_actions()))
+    return position.state()
 
 
 def backpropagate(node: MCTSNode|None, won: bool):
@@ -0,0 +1,173 @@
+import random
+import sys
+from timeit import default_timer as time
+
+import p2_t3
+
+board = p2_t3.Board()
+
+
+class ScanBoard(p2_t3.Board):
+    """ The board as it was before the lookup tables: every win and full-board test scans the eight lines. """
+
+    def next_state(self, state, action):
+        R, C, r, c = action
+        player = state[-1]
+        board_index = 2 * (3 * R + C)
+        player_index = player - 1
+
+        state = list(state)
+        state[-1] = 3 - player
+        state[board_index + player_index] |= p2_t3.positions[(r, c)]
+        updated_board = state[board_index + player_index]
+
+        full = (state[board_index] | state[board_index + 1] == 0x1ff)
+        if any(updated_board & w == w for w in self.wins):
+            state[18 + player_index] |= p2_t3.positions[(R, C)]
+        elif full:
+            state[18] |= p2_t3.positions[(R, C)]
+            state[19] |= p2_t3.positions[(R, C)]
+
+        if (state[18] | state[19]) & p2_t3.positions[(r, c)]:
+            state[20], state[21] = None, None
+        else:
+            state[20], state[21] = r, c
+
+        return tuple(state)
+
+    def is_ended(self, state):
+        p1 = state[18] & ~state[19]
+        p2 = state[19] & ~state[18]
+
+        if any(w & p1 == w for w in self.wins):
+            return True
+        if any(w & p2 == w for w in self.wins):
+            return True
+        if state[18] | state[19] == 0x1ff:
+            return True
+
+        return False
+
+    def points_values(self, state):
+        if not self.is_ended(state):
+            return
+        p1 = state[18] & ~state[19]
+        p2 = state[19] & ~state[18]
+
+        if any(w & p1 == w for w in self.wins):
+            return {1: 1, 2: -1}
+        if any(w & p2 == w for w in self.wins):
+            return {1: -1, 2: 1}
+        if state[18] | state[19] == 0x1ff:
+            return {1: 0, 2: 0}
+
+
+scan_board = ScanBoard()
+
+
+def random_games(count, seed=0):
+    """ Plays count games of uniformly random moves, returning every (state, action) pair played. """
+    rng = random.Random(seed)
+    moves = []
+    for _ in range(count):
+        state = board.starting_state()
+        while not board.is_ended(state):
+            action = rng.choice(board.legal_actions(state))
+            moves.append((state, action))
+            state = board.next_state(state, action)
+    return moves
+
+
+def calls_per_second(function, arguments, repeats=5):
+    """ The best rate over repeats runs of function(*args) for every args in arguments. """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time()
+        for args in arguments:
+            function(*args)
+        best = min(best, time() - start)
+    return len(arguments) / best
+
+
+def check_mutable_board(count, seed=0):
+    """ Plays count random games on a MutableBoard next to the tuple API, asserting they agree at every step.
+
+    Each game is played forward with push, sometimes taking a few moves back and replaying others (as tree
+    descent and rollouts do), and finally popped all the way back to the start.
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        position = p2_t3.MutableBoard()
+        history = [board.starting_state()]
+        while True:
+            state = history[-1]
+            assert position.state() == state
+            assert list(position.legal_actions()) == board.legal_actions(state)
+            assert position.is_ended() == board.is_ended(state)
+            assert position.points_values() == board.points_values(state)
+            assert position.win_values() == board.win_values(state)
+            assert position.owned_boxes() == board.owned_boxes(state)
+            assert position.current_player() == board.current_player(state)
+            if board.is_ended(state):
+                break
+            if len(history) > 1 and rng.random() < 0.1:
+                for _ in range(rng.randint(1, len(history) - 1)):
+                    position.pop()
+                    history.pop()
+                continue
+            action = rng.choice(board.legal_actions(state))
+            position.push(action)
+            history.append(board.next_state(state, action))
+
+        while len(history) > 1:
+            history.pop()
+            position.pop()
+            assert position.state() == history[-1]
+
+
+def tuple_rollout(state, rng):
+    while not board.is_ended(state):
+        state = board.next_state(state, rng.choice(board.legal_actions(state)))
+    return state
+
+
+def mutable_rollout(state, rng):
+    position = p2_t3.MutableBoard(state, board)
+    while not position.is_ended():
+        position.push(rng.choice(position.legal_actions()))
+    return position.state()
+
+
+def rollouts_per_second(rollout, states, seed=0, repeats=3):
+    """ The best rate over repeats runs of one seeded rollout from each state, and the final states reached. """
+    best = float('inf')
+    for _ in range(repeats):
+        rng = random.Random(seed)
+        start = time()
+        ends = [rollout(state, rng) for state in states]
+        best = min(best, time() - start)
+    return len(states) / best, ends
+
+
+if __name__ == '__main__':
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    moves = random_games(games)
+    states = [(state,) for state, _ in moves]
+
+    print("%d moves from %d random games" % (len(moves), games))
+    print("%-13s %14s %14s" % ('', 'line scans', 'tables'))
+    for name, arguments in (('next_state', moves), ('is_ended', states), ('points_values', states)):
+        scan, table = getattr(scan_board, name), getattr(board, name)
+        assert all(scan(*args) == table(*args) for args in arguments)
+        scan_rate, table_rate = calls_per_second(scan, arguments), calls_per_second(table, arguments)
+        print("%-13s %12.0f/s %12.0f/s (%.2fx)" % (name, scan_rate, table_rate, table_rate / scan_rate))
+
+    check_mutable_board(games // 4)
+    print("MutableBoard agrees with the tuple API over %d random games" % (games // 4))
+
+    starts = [state for state, _ in moves[::20]]
+    tuple_rate, tuple_ends = rollouts_per_second(tuple_rollout, starts)
+    mutable_rate, mutable_ends = rollouts_per_second(mutable_rollout, starts)
+    assert tuple_ends == mutable_ends
+    print("rollouts      %12.0f/s tuple, %.0f/s push/pop (%.2fx)"
+          % (tuple_rate, mutable_rate, mutable_rate / tuple_rate))
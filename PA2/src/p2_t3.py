@@ -30,17 +30,36 @@ inv_positions = dict(
     (v, P) for P, v in positions.items()
 )
 
-class Board(object):
-    wins = [
-        positions[(r, 0)] | positions[(r, 1)] | positions[(r, 2)]
-        for r in range(3)
-    ] + [
-        positions[(0, c)] | positions[(1, c)] | positions[(2, c)]
-        for c in range(3)
-    ] + [
-        positions[(0, 0)] | positions[(1, 1)] | positions[(2, 2)],
-        positions[(0, 2)] | positions[(1, 1)] | positions[(2, 0)],
+win_lines = [
+    positions[(r, 0)] | positions[(r, 1)] | positions[(r, 2)]
+    for r in range(3)
+] + [
+    positions[(0, c)] | positions[(1, c)] | positions[(2, c)]
+    for c in range(3)
+] + [
+    positions[(0, 0)] | positions[(1, 1)] | positions[(2, 2)],
+    positions[(0, 2)] | positions[(1, 1)] | positions[(2, 0)],
+]
+
+# Lookup tables indexed by a 9-bit (sub-)board mask: whether the mask holds
+# a whole line, and whether it covers the board.
+is_won = [any(mask & w == w for w in win_lines) for mask in range(512)]
+is_full = [mask == 0x1ff for mask in range(512)]
+
+# The actions into each sub-board (indexed 3 * R + C) that are still open
+# for each mask of occupied cells, in legal_actions' order. The rows are
+# tuples so they can be handed out without copying.
+open_actions = [
+    [
+        tuple((R, C, r, c) for r in range(3) for c in range(3) if not occupied & positions[(r, c)])
+        for occupied in range(512)
     ]
+    for R in range(3)
+    for C in range(3)
+]
+
+class Board(object):
+    wins = win_lines
 
     def starting_state(self):
         # Each of the 9 pairs of player 1 and player 2 board bitmasks
@@ -194,8 +213,8 @@ class Board(object):
         state[board_index + player_index] |= positions[(r, c)]
         updated_board = state[board_index + player_index]
 
-        full = (state[board_index] | state[board_index + 1] == 0x1ff)
-        if any(updated_board & w == w for w in self.wins):
+        full = is_full[state[board_index] | state[board_index + 1]]
+        if is_won[updated_board]:
             state[18 + player_index] |= positions[(R, C)]
         elif full:
             state[18] |= positions[(R, C)]
@@ -239,26 +258,17 @@ class Board(object):
         return (R, C) == (state[20], state[21])
 
     def legal_actions(self, state):
-        R, C = state[20], state[21]
-        Rset, Cset = (R,), (C,)
-        if R is None:
-            Rset, Cset = range(3), range(3)
-
-        occupied = [
-            state[2 * x] | state[2 * x + 1] for x in range(9)
-        ]
         finished = state[18] | state[19]
-
-        actions = [
-            (R, C, r, c)
-            for R in Rset
-            for C in Cset
-            for r in range(3)
-            for c in range(3)
-            if not occupied[3 * R + C] & positions[(r, c)]
-            and not finished & positions[(R, C)]
-        ]
-
+        if state[20] is not None:
+            x = 3 * state[20] + state[21]
+            if finished & (1 << x):
+                return []
+            return list(open_actions[x][state[2 * x] | state[2 * x + 1]])
+
+        actions = []
+        for x in range(9):
+            if not finished & (1 << x):
+                actions.extend(open_actions[x][state[2 * x] | state[2 * x + 1]])
         return actions
 
     def previous_player(self, state):
@@ -271,14 +281,7 @@ class Board(object):
         p1 = state[18] & ~state[19]
         p2 = state[19] & ~state[18]
 
-        if any(w & p1 == w for w in self.wins):
-            return True
-        if any(w & p2 == w for w in self.wins):
-            return True
-        if state[18] | state[19] == 0x1ff:
-            return True
-
-        return False
+        return is_won[p1] or is_won[p2] or is_full[state[18] | state[19]]
 
     def win_values(self, state):
         if not self.is_ended(state):
@@ -286,11 +289,11 @@ class Board(object):
         p1 = state[18] & ~state[19]
         p2 = state[19] & ~state[18]
 
-        if any(w & p1 == w for w in self.wins):
+        if is_won[p1]:
             return {1: 1, 2: 0}
-        if any(w & p2 == w for w in self.wins):
+        if is_won[p2]:
             return {1: 0, 2: 1}
-        if state[18] | state[19] == 0x1ff:
+        if is_full[state[18] | state[19]]:
             return {1: 0.5, 2: 0.5}
 
     def owned_boxes(self, state):
@@ -313,11 +316,11 @@ class Board(object):
         p1 = state[18] & ~state[19]
         p2 = state[19] & ~state[18]
 
-        if any(w & p1 == w for w in self.wins):
+        if is_won[p1]:
             return {1: 1, 2: -1}
-        if any(w & p2 == w for w in self.wins):
+        if is_won[p2]:
             return {1: -1, 2: 1}
-        if state[18] | state[19] == 0x1ff:
+        if is_full[state[18] | state[19]]:
             return {1: 0, 2: 0}
 
     def winner_message(self, winners):
@@ -326,3 +329,108 @@ class Board(object):
         if value == 0.5:
             return "Draw."
         return "Winner: Player {0}.".format(winner)
+
+
+class MutableBoard(object):
+    """ A single game position, changed in place by push(action) and restored by pop().
+
+    The state is kept as a 23-element list laid out like Board's state tuples, and every push saves the five
+    entries it may overwrite on a preallocated undo stack, so playing and unplaying moves builds no containers.
+    The Board queries are answered on the list directly. state() returns the tuple Board would have reached.
+    """
+
+    max_plies = 81
+
+    def __init__(self, state=None, board=None):
+        self.board = board or Board()
+        self.cells = list(state if state is not None else self.board.starting_state())
+        self.depth = 0
+        self.actions = [None] * self.max_plies
+        self.saved = [None] * (5 * self.max_plies)
+
+    def push(self, action):
+        """ Plays action, exactly as Board.next_state would. """
+        R, C, r, c = action
+        s = self.cells
+        player = s[22]
+        board_index = 2 * (3 * R + C)
+        index = board_index + player - 1
+        cell, box = 1 << (3 * r + c), 1 << (3 * R + C)
+
+        depth = self.depth
+        self.actions[depth] = action
+        saved, k = self.saved, 5 * depth
+        saved[k] = s[index]
+        saved[k + 1] = s[18]
+        saved[k + 2] = s[19]
+        saved[k + 3] = s[20]
+        saved[k + 4] = s[21]
+        self.depth = depth + 1
+
+        s[22] = 3 - player
+        updated_board = s[index] | cell
+        s[index] = updated_board
+        if is_won[updated_board]:
+            s[17 + player] |= box
+        elif is_full[s[board_index] | s[board_index + 1]]:
+            s[18] |= box
+            s[19] |= box
+
+        if (s[18] | s[19]) & cell:
+            s[20] = s[21] = None
+        else:
+            s[20], s[21] = r, c
+
+    def pop(self):
+        """ Takes back the last pushed action and returns it. """
+        depth = self.depth - 1
+        self.depth = depth
+        R, C, _, _ = action = self.actions[depth]
+        s = self.cells
+        s[22] = player = 3 - s[22]
+        saved, k = self.saved, 5 * depth
+        s[2 * (3 * R + C) + player - 1] = saved[k]
+        s[18] = saved[k + 1]
+        s[19] = saved[k + 2]
+        s[20] = saved[k + 3]
+        s[21] = saved[k + 4]
+        return action
+
+    def state(self):
+        return tuple(self.cells)
+
+    def current_player(self):
+        return self.cells[22]
+
+    def previous_player(self):
+        return 3 - self.cells[22]
+
+    def legal_actions(self):
+        """ The legal actions, in Board.legal_actions' order, as a read-only sequence.
+
+        When the next move is sent to an unfinished sub-board this is that sub-board's row of open_actions,
+        shared rather than copied; only a move that may go anywhere builds a new list.
+        """
+        s = self.cells
+        if s[20] is not None:
+            x = 3 * s[20] + s[21]
+            if (s[18] | s[19]) & (1 << x):
+                return ()
+            return open_actions[x][s[2 * x] | s[2 * x + 1]]
+        return self.board.legal_actions(s)
+
+    def is_legal(self, action):
+        return self.board.is_legal(self.cells, action)
+
+    def is_ended(self):
+        s = self.cells
+        return is_won[s[18] & ~s[19]] or is_won[s[19] & ~s[18]] or is_full[s[18] | s[19]]
+
+    def win_values(self):
+        return self.board.win_values(self.cells)
+
+    def points_values(self):
+        return self.board.points_values(self.cells)
+
+    def owned_boxes(self):
+        return self.board.owned_boxes(self.cells)